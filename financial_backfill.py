@@ -0,0 +1,155 @@
+from modules.financial_data import SMT_FinancialData, EXPORT_FILES
+from utils.logger import get_logger
+from utils.browser_service import get_browser_service
+from utils.dingtalk_bot import ding_bot_send
+from pathlib import Path
+from datetime import datetime
+import asyncio
+import argparse
+import json
+import time
+
+
+"""按月份区间补下载smt财务数据：每个店铺只登录一次，在同一个会话里依次导出各个月份"""
+
+logger = get_logger(f"financial_data")
+
+MANIFEST_DIR = Path(__file__).resolve().parent / "data" / "financial" / "backfill"
+
+
+def format_seconds(seconds: float) -> str:
+    m, s = divmod(int(seconds), 60)
+    return f"{m}分{s}秒"
+
+
+def month_range(start: str, end: str) -> list:
+    """
+    '2025-01', '2025-03' -> ['2025-01', '2025-02', '2025-03']
+    """
+    year, month = map(int, start.split("-"))
+    end_year, end_month = map(int, end.split("-"))
+    if (year, month) > (end_year, end_month):
+        raise ValueError(f"开始月份 {start} 晚于结束月份 {end}")
+
+    months = []
+    while (year, month) <= (end_year, end_month):
+        months.append(f"{year}-{month:02d}")
+        year, month = (year + 1, 1) if month == 12 else (year, month + 1)
+    return months
+
+
+async def backfill_shop(shop_name, months, mode="ui"):
+    """
+    Returns:
+        该店铺的清单条目列表
+    """
+    t = SMT_FinancialData(shop_name, months[-1], mode=mode)
+
+    # 下载清单里校验通过的跳过，只补缺失或损坏的
+    todo = t.pending_exports(months)
+    entries = {
+        (month_str, kind): "skipped"
+        for month_str in months for kind in EXPORT_FILES
+        if (month_str, kind) not in todo
+    }
+
+    if todo:
+        entries.update(await t.run_backfill(todo))
+    else:
+        logger.info(f"{shop_name} - 所有月份的文件都已存在，不用登录")
+
+    result = []
+    for (month_str, kind), status in sorted(entries.items()):
+        path = t.export_path(month_str, kind)
+        entry = t.manifest.get(path) if status != "failed" else None
+        result.append({
+            "shop": shop_name,
+            "month": month_str,
+            "kind": kind,
+            "status": status,
+            "path": str(path),
+            **({"size": entry["size"], "sha256": entry["sha256"]} if entry else {}),
+        })
+    return result
+
+
+async def run_backfill(shop_name_list, months, pool_size=3, mode="ui"):
+    semaphore = asyncio.Semaphore(max(1, pool_size))
+
+    async def _run(shop_name):
+        async with semaphore:
+            try:
+                return await backfill_shop(shop_name, months, mode=mode)
+            except Exception as e:
+                logger.error(f'{shop_name} 补数失败: {e}', exc_info=True)
+                return [
+                    {"shop": shop_name, "month": m, "kind": k, "status": "failed", "error": str(e)}
+                    for m in months for k in EXPORT_FILES
+                ]
+
+    shop_entries = await asyncio.gather(*(_run(name) for name in shop_name_list))
+    return [entry for entries in shop_entries for entry in entries]
+
+
+def write_manifest(start, end, entries):
+    MANIFEST_DIR.mkdir(parents=True, exist_ok=True)
+    path = MANIFEST_DIR / f"backfill_{start}_{end}_{datetime.now():%Y%m%d%H%M%S}.json"
+    data = {
+        "start": start,
+        "end": end,
+        "created_at": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        "entries": entries,
+    }
+    path.write_text(json.dumps(data, ensure_ascii=False, indent=2), encoding="utf-8")
+    return path
+
+
+async def main(start, end, pool_size=3, mode="ui", shops=None):
+    total_start = time.perf_counter()
+    months = month_range(start, end)
+    shop_name_list = shops or ['SMT202', 'SMT214', 'SMT212', 'SMT204', 'SMT203', 'SMT201', 'SMT208']
+    logger.info(f'开始补数 {start} ~ {end}，共 {len(months)} 个月，{len(shop_name_list)} 个店铺')
+
+    try:
+        entries = await run_backfill(shop_name_list, months, pool_size=pool_size, mode=mode)
+    finally:
+        await get_browser_service().close()
+
+    manifest = write_manifest(start, end, entries)
+
+    counts = {}
+    for e in entries:
+        counts[e["status"]] = counts.get(e["status"], 0) + 1
+    failed = sorted({f'{e["shop"]} {e["month"]}' for e in entries if e["status"] == "failed"})
+
+    total_cost = time.perf_counter() - total_start
+    summary = (
+        f'SMT财务补数 {start} ~ {end} 完成：下载 {counts.get("fetched", 0)}，'
+        f'已存在 {counts.get("skipped", 0)}，失败 {counts.get("failed", 0)}，'
+        f'耗时 {format_seconds(total_cost)}\n清单：{manifest}'
+    )
+    if failed:
+        summary += f'\n失败: {", ".join(failed)}'
+    logger.info(summary)
+    ding_bot_send('me', summary)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="按月份区间补下载smt财务数据")
+    parser.add_argument("--start", required=True, help="开始月份 YYYY-MM")
+    parser.add_argument("--end", required=True, help="结束月份 YYYY-MM（含）")
+    parser.add_argument("--pool-size", type=int, default=3, help="最多同时运行的店铺数")
+    parser.add_argument("--mode", choices=("ui", "record", "api"), default="ui", help="导出方式，同 financial_month_job")
+    parser.add_argument("--shops", default="", help="只补这些店铺，逗号分隔")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    asyncio.run(main(
+        start=args.start,
+        end=args.end,
+        pool_size=args.pool_size,
+        mode=args.mode,
+        shops=[s for s in args.shops.split(",") if s],
+    ))
@@ -1,7 +1,11 @@
 from modules.financial_data import SMT_FinancialData
 from utils.logger import get_logger
 from utils.config_loader import get_shop_config
+from utils.browser_service import get_browser_service
+from utils.dingtalk_bot import ding_bot_send
+from modules.ledger_ingest import ingest_month
 import asyncio
+import argparse
 import time
 from datetime import datetime
 
@@ -33,19 +37,87 @@ def get_prev_month_from_now() -> str:
 
 
 
-async def main():
+async def run_financial_shops(shop_name_list, month_str, pool_size=3, mode="ui"):
+    """
+    多店铺并发导出财务数据，最多同时 pool_size 个店铺（也就是同时占用的云浏览器数）
+
+    每个店铺自己重试（SMT_FinancialData.run），互不影响
+
+    Returns:
+        每个店铺的执行结果列表（顺序与 shop_name_list 一致）
+    """
+    semaphore = asyncio.Semaphore(max(1, pool_size))
+
+    async def _run(shop_name):
+        async with semaphore:
+            start = time.perf_counter()
+            try:
+                ok = await SMT_FinancialData(shop_name, month_str, mode=mode).run()
+                error = None if ok else "已达到最大重试次数"
+            except Exception as e:
+                logger.error(f'{shop_name} 执行失败: {e}', exc_info=True)
+                ok, error = False, str(e)
+            return {
+                "shop": shop_name,
+                "success": ok,
+                "error": error,
+                "cost": time.perf_counter() - start,
+            }
+
+    return await asyncio.gather(*(_run(name) for name in shop_name_list))
+
+
+def format_shop_results(results, total_cost):
+    lines = []
+    for r in results:
+        if r["success"]:
+            lines.append(f'{r["shop"]}: 成功，耗时 {format_seconds(r["cost"])}')
+        else:
+            lines.append(f'{r["shop"]}: 失败（{r["error"]}），耗时 {format_seconds(r["cost"])}')
+    lines.append(f'总耗时：{format_seconds(total_cost)}')
+    return "\n".join(lines)
+
+
+async def main(pool_size=3, mode="ui", ingest=False):
     total_start = time.perf_counter()
-    logger.info('程序开始启动')
+    logger.info(f'程序开始启动，最多同时运行 {pool_size} 个店铺')
     shop_name_list = ['SMT202', 'SMT214', 'SMT212', 'SMT204', 'SMT203', 'SMT201', 'SMT208']
     month_str=get_prev_month_from_now()
     logger.info(f'正在下载{month_str}的数据')
-    for name in shop_name_list:
-        t = SMT_FinancialData(name,month_str)
-        await t.run()
+    try:
+        results = await run_financial_shops(shop_name_list, month_str, pool_size=pool_size, mode=mode)
+    finally:
+        await get_browser_service().close()
+
+    if ingest:
+        # 财务动账 zip、其他收支结算 xlsx 入账本（data/ledger），内部用进程池，这里放到线程里等
+        counts = await asyncio.to_thread(ingest_month, month_str)
+        logger.info(f"财务动账入账完成: {counts}")
 
     total_cost = time.perf_counter() - total_start
+    summary = format_shop_results(results, total_cost)
+    logger.info(f"店铺执行结果:\n{summary}")
+
+    failed = [r["shop"] for r in results if not r["success"]]
+    if failed:
+        ding_bot_send('me', f'SMT的{month_str}财务任务完成，失败店铺: {",".join(failed)}\n{summary}')
+    else:
+        ding_bot_send('me', f'SMT的{month_str}财务任务完成\n{summary}')
+
     logger.info(f"🎯 全流程完成，总耗时：{format_seconds(total_cost)}")
 
 
+def parse_args():
+    parser = argparse.ArgumentParser(description="下载smt上个月的财务数据")
+    parser.add_argument("--pool-size", type=int, default=3, help="最多同时运行的店铺数（同时占用的云浏览器数）")
+    parser.add_argument(
+        "--mode", choices=("ui", "record", "api"), default="ui",
+        help="ui: 页面导出；record: 页面导出并录制接口；api: 回放录制的接口，失败退回页面",
+    )
+    parser.add_argument("--ingest", action="store_true", help="下载完把财务动账写入 data/ledger 账本")
+    return parser.parse_args()
+
+
 if __name__ == "__main__":
-    asyncio.run(main())
\ No newline at end of file
+    args = parse_args()
+    asyncio.run(main(pool_size=args.pool_size, mode=args.mode, ingest=args.ingest))
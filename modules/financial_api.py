@@ -0,0 +1,343 @@
+import json
+import re
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Dict, List, Optional
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+import aiohttp
+
+from utils.logger import get_logger
+
+"""财务导出的接口录制 / 回放
+
+record：照常走页面流程，同时记下导出用到的请求（含 Alipay 弹窗）：
+        URL 里明确带 export 的调用，以及真正返回文件的那个请求（download 事件 / 附件响应），
+        按店铺存到 data/financial/api_templates/{店铺}.json；
+        只有日期类参数（startDate、endTime、billMonth 等）里的月份会换成占位符
+api：   登录后直接用 context 的 cookie 按模板发请求，换成目标月份，标记为 file 的那一步的响应就是文件；
+        模板不存在或回放失败时调用方退回页面流程
+
+只适用于请求参数只和月份有关的接口；如果导出要先拿任务 ID 再下载，回放会拿不到文件而失败，
+这时继续走页面流程即可
+"""
+
+TEMPLATE_DIR = Path(__file__).resolve().parent.parent / "data" / "financial" / "api_templates"
+
+# 明确的导出调用：URL 里带 export 的 xhr / fetch（列表、轮询接口不记）
+EXPORT_URL_RE = re.compile(r"export", re.I)
+RECORD_RESOURCE_TYPES = ("xhr", "fetch", "document", "other")
+STATIC_URL_RE = re.compile(r"\.(js|css|png|jpe?g|gif|svg|woff2?|ttf|ico)(\?|$)", re.I)
+
+# 响应是文件：附件，或者 zip / xlsx 的 content-type
+FILE_CONTENT_TYPE_RE = re.compile(r"(zip|octet-stream|spreadsheet|excel)", re.I)
+
+# 只有这些参数名里的月份才换成占位符，其他参数（token、时间戳、签名）原样保留
+DATE_PARAM_RE = re.compile(r"(date|time|month|start|end|begin|gmt|period)", re.I)
+
+# 回放时不带的请求头（由 aiohttp 重新生成，cookie 另外传）
+SKIP_HEADERS = {"cookie", "content-length", "host", "connection", "accept-encoding"}
+
+# JSON 里原来是数字的占位符，回放时转回 int
+INT_PLACEHOLDER_RE = re.compile(r"^\{(\w+)\|int\}$")
+
+
+class FinancialApiError(Exception):
+    """回放没有拿到文件"""
+
+
+def month_tokens(month_str: str) -> List[tuple]:
+    """
+    某个月在请求里可能出现的写法，(占位符, 值)，按长度从长到短排好，前缀匹配时先匹配长的
+    """
+    year, month = map(int, month_str.split("-"))
+    start = datetime(year, month, 1)
+    next_month = datetime(year + (month == 12), month % 12 + 1, 1)
+    end = next_month - timedelta(days=1)
+
+    start_ms = int(start.timestamp() * 1000)
+    end_ms = int(next_month.timestamp() * 1000) - 1
+
+    tokens = [
+        ("{start_ms}", str(start_ms)),
+        ("{end_ms}", str(end_ms)),
+        ("{end_ms_sec}", str(end_ms - 999)),
+        ("{next_month_ms}", str(end_ms + 1)),
+        ("{start_date}", start.strftime("%Y-%m-%d")),
+        ("{end_date}", end.strftime("%Y-%m-%d")),
+        ("{start_date_slash}", start.strftime("%Y/%m/%d")),
+        ("{end_date_slash}", end.strftime("%Y/%m/%d")),
+        ("{start_yyyymmdd}", start.strftime("%Y%m%d")),
+        ("{end_yyyymmdd}", end.strftime("%Y%m%d")),
+        ("{month}", start.strftime("%Y-%m")),
+        ("{yyyymm}", start.strftime("%Y%m")),
+    ]
+    return sorted(tokens, key=lambda t: len(t[1]), reverse=True)
+
+
+def to_template(value, month_str: str):
+    """
+    一个日期参数的值 -> 占位符；整值相等，或者日期后面跟着时间（'2025-03-01 00:00:00'）才替换
+    """
+    if isinstance(value, bool) or not isinstance(value, (str, int)):
+        return value
+    text = str(value)
+    for placeholder, token in month_tokens(month_str):
+        if text == token:
+            return f"{{{placeholder[1:-1]}|int}}" if isinstance(value, int) else placeholder
+        if isinstance(value, str) and text.startswith(token + " "):
+            return placeholder + text[len(token):]
+    return value
+
+
+def from_template(value, month_str: str):
+    if not isinstance(value, str) or "{" not in value:
+        return value
+    tokens = dict(month_tokens(month_str))
+    m = INT_PLACEHOLDER_RE.match(value)
+    if m and f"{{{m.group(1)}}}" in tokens:
+        return int(tokens[f"{{{m.group(1)}}}"])
+    for placeholder, token in tokens.items():
+        value = value.replace(placeholder, token)
+    return value
+
+
+def template_pairs(pairs: List[tuple], month_str: str) -> List[list]:
+    """
+    query / 表单参数，只替换日期类参数
+    """
+    return [[k, to_template(v, month_str) if DATE_PARAM_RE.search(k) else v] for k, v in pairs]
+
+
+def template_json(obj, month_str: str, key: str = ""):
+    """
+    JSON 请求体，递归找日期类的键
+    """
+    if isinstance(obj, dict):
+        return {k: template_json(v, month_str, k) for k, v in obj.items()}
+    if isinstance(obj, list):
+        return [template_json(v, month_str, key) for v in obj]
+    if key and DATE_PARAM_RE.search(key):
+        return to_template(obj, month_str)
+    return obj
+
+
+def fill_json(obj, month_str: str):
+    if isinstance(obj, dict):
+        return {k: fill_json(v, month_str) for k, v in obj.items()}
+    if isinstance(obj, list):
+        return [fill_json(v, month_str) for v in obj]
+    return from_template(obj, month_str)
+
+
+# ---------- 模板存取 ----------
+def template_file(shop_name: str) -> Path:
+    return TEMPLATE_DIR / f"{shop_name}.json"
+
+
+def load_templates(shop_name: str) -> Dict[str, dict]:
+    path = template_file(shop_name)
+    if not path.exists():
+        return {}
+    return json.loads(path.read_text(encoding="utf-8"))
+
+
+def save_template(shop_name: str, kind: str, template: dict):
+    templates = load_templates(shop_name)
+    templates[kind] = template
+
+    TEMPLATE_DIR.mkdir(parents=True, exist_ok=True)
+    path = template_file(shop_name)
+    tmp_path = path.with_suffix(".json.tmp")
+    tmp_path.write_text(json.dumps(templates, ensure_ascii=False, indent=2), encoding="utf-8")
+    tmp_path.replace(path)
+
+
+# ---------- 录制 ----------
+class ExportRecorder:
+    def __init__(self, kind: str, month_str: str):
+        """
+        Args:
+            kind: other_bill / history_bill
+            month_str: 页面上选的月份，录制时替换成占位符
+        """
+        self.kind = kind
+        self.month_str = month_str
+        self.steps: List[dict] = []
+        # 录制期间见过的请求，按 URL 找回返回文件的那一个
+        self._seen: Dict[str, dict] = {}
+        self._pages = []
+
+    def attach(self, page):
+        """
+        监听 page 以及它打开的弹窗（历史账单在 Alipay 弹窗里导出）
+        """
+        self._pages.append(page)
+        page.on("request", self._on_request)
+        page.on("response", self._on_response)
+        page.on("download", self._on_download)
+        page.on("popup", self.attach)
+
+    def detach(self):
+        for page in self._pages:
+            try:
+                page.remove_listener("request", self._on_request)
+                page.remove_listener("response", self._on_response)
+                page.remove_listener("download", self._on_download)
+                page.remove_listener("popup", self.attach)
+            except Exception:
+                pass
+        self._pages = []
+
+    def _build_step(self, request) -> dict:
+        parts = urlsplit(request.url)
+        headers = {
+            k: v for k, v in request.headers.items()
+            if k.lower() not in SKIP_HEADERS and not k.startswith(":")
+        }
+        step = {
+            "method": request.method,
+            "url": urlunsplit((parts.scheme, parts.netloc, parts.path, "", "")),
+            "params": template_pairs(parse_qsl(parts.query, keep_blank_values=True), self.month_str),
+            "headers": headers,
+            "body_type": None,
+            "body": None,
+            "file": False,
+        }
+
+        post_data = request.post_data
+        if not post_data:
+            return step
+
+        content_type = headers.get("content-type", "").lower()
+        if "json" in content_type:
+            try:
+                step["body_type"] = "json"
+                step["body"] = template_json(json.loads(post_data), self.month_str)
+                return step
+            except ValueError:
+                pass
+        if "x-www-form-urlencoded" in content_type:
+            step["body_type"] = "form"
+            step["body"] = template_pairs(parse_qsl(post_data, keep_blank_values=True), self.month_str)
+            return step
+
+        # 其他格式看不懂哪里是日期，原样回放
+        step["body_type"] = "raw"
+        step["body"] = post_data
+        return step
+
+    def _on_request(self, request):
+        url = request.url
+        if request.resource_type not in RECORD_RESOURCE_TYPES or STATIC_URL_RE.search(url):
+            return
+
+        step = self._build_step(request)
+        self._seen[url] = step
+        if EXPORT_URL_RE.search(urlsplit(url).path):
+            self.steps.append(step)
+
+    def _mark_file(self, url: str):
+        step = self._seen.get(url)
+        if step is None:
+            return
+        step["file"] = True
+        if not any(s is step for s in self.steps):
+            self.steps.append(step)
+
+    def _on_response(self, response):
+        headers = response.headers
+        if "attachment" in headers.get("content-disposition", "").lower() \
+                or FILE_CONTENT_TYPE_RE.search(headers.get("content-type", "")):
+            self._mark_file(response.request.url)
+
+    def _on_download(self, download):
+        self._mark_file(download.url)
+
+    def template(self) -> Optional[dict]:
+        """
+        没录到返回文件的请求时返回 None；文件那一步之后的请求不要
+        """
+        file_idx = [i for i, step in enumerate(self.steps) if step["file"]]
+        if not file_idx:
+            return None
+        return {
+            "steps": self.steps[:file_idx[-1] + 1],
+            "recorded_month": self.month_str,
+            "recorded_at": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        }
+
+
+# ---------- 回放 ----------
+class FinancialApiClient:
+    def __init__(self, shop_name: str, cookies: List[dict]):
+        """
+        cookies: 登录后 context.cookies() 的结果（含 aliexpress 和 alipay 两边的域名）
+        """
+        self.shop_name = shop_name
+        self.cookies = cookies
+        self.templates = load_templates(shop_name)
+        self.logger = get_logger("financial_api")
+
+    def has_template(self, kind: str) -> bool:
+        # 老格式的模板没有 file 标记，当作没有录制过
+        steps = self.templates.get(kind, {}).get("steps") or []
+        return any(step.get("file") for step in steps)
+
+    def _cookie_header(self, url: str) -> str:
+        host = re.sub(r"^https?://", "", url).split("/")[0].split(":")[0]
+        pairs = [
+            f"{c['name']}={c['value']}"
+            for c in self.cookies
+            if host == c["domain"].lstrip(".") or host.endswith("." + c["domain"].lstrip("."))
+        ]
+        return "; ".join(pairs)
+
+    @staticmethod
+    def _request_body(step: dict, month_str: str) -> Optional[bytes]:
+        body = step.get("body")
+        if body is None:
+            return None
+        if step["body_type"] == "json":
+            return json.dumps(fill_json(body, month_str), ensure_ascii=False).encode("utf-8")
+        if step["body_type"] == "form":
+            return urlencode([(k, from_template(v, month_str)) for k, v in body]).encode("utf-8")
+        return body.encode("utf-8")
+
+    async def export(self, kind: str, month_str: str, save_path: Path) -> Path:
+        """
+        按模板依次发请求，标记为 file 的那一步的响应就是导出文件（xlsx / zip 都以 PK 开头）
+        """
+        if not self.has_template(kind):
+            raise FinancialApiError(f"没有 {kind} 的接口模板")
+
+        body = b""
+        async with aiohttp.ClientSession() as session:
+            for step in self.templates[kind]["steps"]:
+                url = step["url"]
+                params = [(k, str(from_template(v, month_str))) for k, v in step["params"]]
+                headers = {**step["headers"], "cookie": self._cookie_header(url)}
+
+                async with session.request(
+                    step["method"],
+                    url,
+                    params=params or None,
+                    headers=headers,
+                    data=self._request_body(step, month_str),
+                    timeout=aiohttp.ClientTimeout(total=60),
+                ) as resp:
+                    if resp.status != 200:
+                        raise FinancialApiError(f"{kind} 请求失败 HTTP {resp.status}: {url}")
+                    if step["file"]:
+                        body = await resp.read()
+
+        if not body.startswith(b"PK"):
+            raise FinancialApiError(f"{kind} 回放没有拿到文件: {body[:200]!r}")
+
+        save_path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = save_path.with_name(f".{save_path.name}.tmp")
+        tmp_path.write_bytes(body)
+        tmp_path.replace(save_path)
+
+        self.logger.info(f"{self.shop_name} - {kind} 接口导出完成: {save_path}")
+        return save_path
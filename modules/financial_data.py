@@ -1,20 +1,37 @@
-from playwright.async_api import async_playwright
 import json
 from pathlib import Path
 from datetime import datetime,timedelta
-import requests
 import asyncio
 from utils.logger import get_logger
 from utils.cookie_manager import get_shop_config
+from modules.login import wait_for_login, current_session, LoginFailedError
 import math
 import re
 from utils.dingtalk_bot import ding_bot_send
+from utils.browser_service import get_browser_service
+from utils.request_blocker import RequestBlocker
+from modules.financial_api import ExportRecorder, FinancialApiClient, save_template
+from utils.download_manifest import get_download_manifest, verify_zip
 
 
 
+# 导出文件名后缀：other_bill -> 其他收支结算.xlsx，history_bill -> 财务动账.zip
+EXPORT_FILES = {
+    "other_bill": "其他收支结算.xlsx",
+    "history_bill": "财务动账.zip",
+}
+
+
 class SMT_FinancialData:
-    def __init__(self, shop_name,month_str):
+    def __init__(self, shop_name,month_str, mode="ui"):
+        """
+        mode:
+            ui     - 页面点击导出
+            record - 页面点击导出，同时录制导出接口（modules/financial_api）
+            api    - 直接回放录制的接口，失败的那一项退回页面流程
+        """
         self.month_str=month_str
+        self.mode = mode
         self.shop_name = shop_name
         cfg = get_shop_config(shop_name)
         self.channel_id = cfg["channelId"]
@@ -22,45 +39,22 @@ class SMT_FinancialData:
         self.username = cfg["account"]
         self.password = cfg["password"]
 
-        self.playwright = None
-        self.browser = None
+        self.browser_service = get_browser_service()
+        self.manifest = get_download_manifest()
         self.context = None
         self.page = None
+        self.blocker = None
 
         self.logger = get_logger("financial_data")
 
     # ----------- 浏览器 -----------
-    def start_cloud_browser(self) -> str:
-        url = "http://localhost:50213/api/v2/browser/start"
-        resp = requests.get(
-            url,
-            params={"account_id": self.cloud_account_id},
-            timeout=10
-        )
-        resp.raise_for_status()
-        return resp.json()["data"]["ws"]['puppeteer']
-
-    def stop_cloud_browser(self):
-        """
-        通过云浏览器 API 关闭浏览器实例
-        """
-        url = "http://localhost:50213/api/v2/browser/stop"
-        try:
-            resp = requests.get(
-                url,
-                params={"account_id": self.cloud_account_id},
-                timeout=10
-            )
-            resp.raise_for_status()
-            print(f"[{self.shop_name}] 云浏览器已关闭")
-        except Exception as e:
-            print(f"[{self.shop_name}] 关闭云浏览器失败: {e}")
-
     async def start_browser(self):
-        ws_endpoint = self.start_cloud_browser()
-        self.playwright = await async_playwright().start()
-        self.browser = await self.playwright.chromium.connect_over_cdp(ws_endpoint)
-        self.context = self.browser.contexts[0]
+        # driver 和云浏览器连接由 BrowserService 复用，重试时不再冷启动
+        self.context = await self.browser_service.acquire(self.cloud_account_id)
+        # 可选：不加载图片、字体、埋点（config.json 的 request_blocking）
+        self.blocker = RequestBlocker.from_config(name=f"{self.shop_name}-financial")
+        if self.blocker:
+            await self.blocker.attach(self.context)
         self.page = self.context.pages[0] if self.context.pages else await self.context.new_page()
         await self.page.bring_to_front()
 
@@ -87,16 +81,55 @@ class SMT_FinancialData:
         await password_input.wait_for(state='visible', timeout=15_000)
         await password_input.fill(self.password)
 
+        stale_session = await current_session(self.context)
         await self.page.click('button[type="button"]:has-text("登录")')
 
+        # 财务页面只需要登录会话，不等 _m_h5_tk
         try:
-            await self.page.wait_for_url("**/m_apps/**", timeout=300000)
+            await wait_for_login(self.page, required_cookies=('WDK_SESSID',), stale_session=stale_session)
             self.logger.info(f"{self.shop_name} 登录成功")
             return True
-        except Exception:
+        except LoginFailedError as e:
+            self.logger.error(f"{self.shop_name} 登录失败: {e}")
+            return False
+        except TimeoutError:
             self.logger.error(f"{self.shop_name} 登录超时")
             return False
 
+    def pending_exports(self, months) -> list:
+        """
+        清单校验不通过（缺失 / 损坏）需要重新下载的 [(月份, kind), ...]
+
+        老目录里校验通过的文件先移到带年份的新目录，不重新下载
+        """
+        pending = []
+        for month_str in months:
+            for kind in EXPORT_FILES:
+                path = self.export_path(month_str, kind)
+                legacy_path = self.legacy_export_path(month_str, kind)
+                if self.manifest.adopt_legacy(legacy_path, path, self.shop_name, month_str, kind):
+                    self.logger.info(f"{self.shop_name} - 老目录的文件已移到 {path}")
+                if not self.manifest.is_verified(path, self.shop_name, month_str, kind):
+                    pending.append((month_str, kind))
+        return pending
+
+    def export_path(self, month_str: str, kind: str) -> Path:
+        """
+        data/financial/{YYYY}/{MM}月份/smt/{店铺}_{MM}_{类型}；目录带年份，补往年数据不会覆盖今年同月的文件
+        """
+        year, month = month_str.split('-')
+        FINANCIAL_DIR = Path(__file__).resolve().parent.parent / "data" / "financial" / year / (month + '月份') / "smt"
+        FINANCIAL_DIR.mkdir(parents=True, exist_ok=True)
+        return FINANCIAL_DIR / f"{self.shop_name}_{month}_{EXPORT_FILES[kind]}"
+
+    def legacy_export_path(self, month_str: str, kind: str) -> Path:
+        """
+        改成按年份分目录之前的位置 data/financial/{MM}月份/smt/，只用来迁移老文件
+        """
+        month = month_str.split('-')[1]
+        legacy_dir = Path(__file__).resolve().parent.parent / "data" / "financial" / (month + '月份') / "smt"
+        return legacy_dir / f"{self.shop_name}_{month}_{EXPORT_FILES[kind]}"
+
     # 只填年月，然后自动获取到这个月的1号和最后一号
     def get_month_date_range(self, month_str: str) -> dict:
         year, month = map(int, month_str.split("-"))
@@ -115,6 +148,7 @@ class SMT_FinancialData:
     # 输入日期
     async def pick_date_range_by_input(
             self,
+            page,
             start_date: str,
             end_date: str,
     ):
@@ -124,20 +158,20 @@ class SMT_FinancialData:
         """
 
         # 1️⃣ 等待 loading 消失（非常关键）
-        await self.page.wait_for_selector(
+        await page.wait_for_selector(
             '.ant-spin-spinning',
             state='detached',
             timeout=30_000
         )
 
         # 2️⃣ 点击整个日期范围选择框（不是 svg）
-        picker = self.page.locator('div.ant-picker-range')
+        picker = page.locator('div.ant-picker-range')
         await picker.wait_for(state="visible", timeout=20_000)
         await picker.scroll_into_view_if_needed()
         await picker.click(force=True)
 
         # 3️⃣ 定位两个 input
-        inputs = self.page.locator('div.ant-picker-range input')
+        inputs = page.locator('div.ant-picker-range input')
         await inputs.first.wait_for(state="visible", timeout=20_000)
 
         start_input = inputs.nth(0)
@@ -149,7 +183,7 @@ class SMT_FinancialData:
         await start_input.press("Enter")
 
         # 给 AntD 一点反应时间
-        await self.page.wait_for_timeout(300)
+        await page.wait_for_timeout(300)
 
         # 5️⃣ 输入结束日期
         await end_input.click(force=True)
@@ -157,47 +191,47 @@ class SMT_FinancialData:
         await end_input.press("Enter")
 
         # 再给 AntD 一点时间触发内部 onChange
-        await self.page.wait_for_timeout(500)
+        await page.wait_for_timeout(500)
 
     ### 1.历史账单导出
-    async def get_history_bill(self):
+    async def get_history_bill(self, page, month_str: str):
+        """
+        在传入的 page 上进入结算页，点【提现】打开 Alipay 弹窗，在弹窗里导出账务动账
+        """
         self.logger.info(f"{self.shop_name} - 开始获取财务动账数据")
 
         # 1️⃣ 进入 AliExpress 结算管理
-        await self.page.goto(
+        await page.goto(
             f"https://csp.aliexpress.com/m_apps/funds-manage/financial_aechoice?channelId={self.channel_id}",
             wait_until="domcontentloaded",
             timeout=20_000
         )
 
         # 2️⃣ 点击【提现】
-        withdraw_btn = self.page.get_by_role("button", name="提现")
+        withdraw_btn = page.get_by_role("button", name="提现")
         await withdraw_btn.wait_for(state="visible", timeout=15_000)
 
         if not await withdraw_btn.is_enabled():
             raise Exception("提现按钮不可点击")
 
-        # 3️⃣ 捕获新页面（Alipay）
-        async with self.context.expect_page() as p:
+        # 3️⃣ 捕获这个 page 打开的弹窗（Alipay），同一 context 里其他页面打开的不算
+        async with page.expect_popup() as p:
             await withdraw_btn.click()
 
-        new_page = await p.value
-        await new_page.wait_for_load_state("domcontentloaded")
-
-        # 4️⃣ 切换 page
-        self.page = new_page
+        page = await p.value
+        await page.wait_for_load_state("domcontentloaded")
 
         # 5️⃣ 等待跳转到最终 Alipay 业务页（非常关键）
-        await self.page.wait_for_url(
+        await page.wait_for_url(
             "**/global.alipay.com/**",
             timeout=30_000
         )
 
-        self.logger.info(f"已切换到 Alipay 页面: {self.page.url}")
+        self.logger.info(f"已切换到 Alipay 页面: {page.url}")
 
 
         # 点击账务动账
-        bill_menu = self.page.locator(
+        bill_menu = page.locator(
             'a.abMenu-item:has-text("账务动账")'
         )
 
@@ -205,36 +239,32 @@ class SMT_FinancialData:
         await bill_menu.click()
 
        # 输入日期
-        date_range=self.get_month_date_range(self.month_str)
+        date_range=self.get_month_date_range(month_str)
         start_date = date_range["start_date"]
         end_date = date_range["end_date"]
         await self.pick_date_range_by_input(
+            page,
             start_date=start_date,
             end_date=end_date
         )
 
         # 给 AntD 一点时间触发查询
-        await self.page.wait_for_timeout(500)
+        await page.wait_for_timeout(500)
 
         # 点击搜索
-        search_btn=self.page.locator('.ant-btn.ant-btn-primary')
+        search_btn=page.locator('.ant-btn.ant-btn-primary')
         await search_btn.wait_for(state="visible", timeout=20_000)
         await search_btn.click()
 
         await asyncio.sleep(1)
 
         # 点击下载搜索结果
-        download_btn=self.page.locator('.downloadSearchBtn___3NvAY')
+        download_btn=page.locator('.downloadSearchBtn___3NvAY')
         await download_btn.wait_for(state="visible", timeout=20_000)
 
-        FINANCIAL_DIR = Path(__file__).resolve().parent.parent / "data" / "financial" /(str(self.month_str.split('-')[
-            1]) + '月份') /"smt"
-        FINANCIAL_DIR.mkdir(parents=True, exist_ok=True)
+        save_path = self.export_path(month_str, "history_bill")
 
-        file_name = f"{self.shop_name}_{self.month_str.split('-')[1]}_财务动账.zip"
-        save_path = FINANCIAL_DIR / file_name
-
-        async with self.page.expect_download(timeout=60_000) as download_info:
+        async with page.expect_download(timeout=60_000) as download_info:
             await download_btn.click()
 
         download = await download_info.value
@@ -247,12 +277,12 @@ class SMT_FinancialData:
 
 
     # 计算日期所在的位置
-    async def click_month_by_number(self, month: int):
+    async def click_month_by_number(self, page, month: int):
         # 1️⃣ 算 row（你已经验证过）
         row = math.ceil(month / 3) + 1
 
         # 2️⃣ 在这一行里，用文本找 month
-        month_locator = self.page.locator(
+        month_locator = page.locator(
             f".next-row:nth-child({row}) .next-btn-helper:nth-child(1)",
             has_text=str(month)
         )
@@ -262,21 +292,21 @@ class SMT_FinancialData:
         await month_locator.click(force=True)
 
     # 点击年份与月份
-    async def pick_month_by_str(self, month_str: str):
+    async def pick_month_by_str(self, page, month_str: str):
         """
         month_str: '2025-12'
         """
         target_year, target_month = map(int, month_str.split("-"))
 
         # 1️⃣ 打开日历（不用 nth-child，点输入框里的 icon）
-        calendar_icon = self.page.locator(
+        calendar_icon = page.locator(
             "div:nth-child(8) .next-input-inner .next-icon"
         )
         await calendar_icon.wait_for(state="visible", timeout=20_000)
         await calendar_icon.click()
 
         # 2️⃣ 切换到【月】视图（按钮文本是“月”）
-        month_tab = self.page.locator(
+        month_tab = page.locator(
             ".next-btn:nth-child(3) > span"
         )
 
@@ -285,7 +315,7 @@ class SMT_FinancialData:
 
         # 3️⃣ 锁定【当前日历面板】——通过“202X年”
         # 获取当前的年份，与我们想要的年份进行对比
-        year_label = self.page.locator('div:nth-child(1) > div:nth-child(1) > span:nth-child(2)')
+        year_label = page.locator('div:nth-child(1) > div:nth-child(1) > span:nth-child(2)')
 
         await year_label.wait_for(state="visible", timeout=10_000)
 
@@ -298,21 +328,19 @@ class SMT_FinancialData:
                 break
 
             if year > target_year:
-                await self.page.locator('i.next-icon-arrow-double-left').click()
+                await page.locator('i.next-icon-arrow-double-left').click()
             else:
-                await self.page.locator('i.next-icon-arrow-double-right').click()
+                await page.locator('i.next-icon-arrow-double-right').click()
 
-            await self.page.wait_for_timeout(200)
+            await page.wait_for_timeout(200)
 
         # 年份对了再点月份
-        await self.click_month_by_number(target_month)
+        await self.click_month_by_number(page, target_month)
 
         # await asyncio.sleep(2)
 
     # 等待导出完成
-    async def wait_export_success_toast(self, timeout: int = 10_000) -> bool:
-        page = self.page
-
+    async def wait_export_success_toast(self, page, timeout: int = 10_000) -> bool:
         toast = page.get_by_text(
             re.compile(r"(Exported Successfully|导出成功|已成功|成功导出)"),
             exact=False
@@ -327,45 +355,40 @@ class SMT_FinancialData:
             return False
 
     ### 2.其他收支结算导出
-    async def get_other_bill(self):
+    async def get_other_bill(self, page, month_str: str):
         self.logger.info(f"{self.shop_name} - 开始获取其他收支结算数据")
 
-        await self.page.goto(
+        await page.goto(
             f"https://csp.aliexpress.com/m_apps/funds-manage/financial_aechoice?channelId={self.channel_id}",
             wait_until="domcontentloaded",
             timeout=20_000
         )
 
         # 等页面主区域稳定（防止刚进页面就点）
-        withdraw_btn = self.page.get_by_role("button", name="提现")
+        withdraw_btn = page.get_by_role("button", name="提现")
 
         await withdraw_btn.wait_for(state="visible", timeout=15_000)
 
         # 选择日期
-        await self.pick_month_by_str(self.month_str)
+        await self.pick_month_by_str(page, month_str)
 
         # await asyncio.sleep(3)
 
         # 点击导出明细
-        export_btn=self.page.locator('div:nth-child(8) > .finacleExport:nth-child(2)')
+        export_btn=page.locator('div:nth-child(8) > .finacleExport:nth-child(2)')
         await export_btn.wait_for(state="visible", timeout=15_000)
         await export_btn.click()
 
         # 等待导出成功
-        await self.wait_export_success_toast()
+        await self.wait_export_success_toast(page)
 
         # 点击下线
-        download_btn=self.page.locator('.first .next-btn-helper')
+        download_btn=page.locator('.first .next-btn-helper')
         await download_btn.wait_for(state="visible", timeout=15_000)
 
-        FINANCIAL_DIR = Path(__file__).resolve().parent.parent / "data" / "financial" / (str(self.month_str.split('-')[
-            1]) + '月份') / "smt"
-        FINANCIAL_DIR.mkdir(parents=True, exist_ok=True)
+        save_path = self.export_path(month_str, "other_bill")
 
-        file_name = f"{self.shop_name}_{self.month_str.split('-')[1]}_其他收支结算.xlsx"
-        save_path = FINANCIAL_DIR / file_name
-
-        async with self.page.expect_download(timeout=60_000) as download_info:
+        async with page.expect_download(timeout=60_000) as download_info:
             await download_btn.click()
 
         download = await download_info.value
@@ -378,6 +401,69 @@ class SMT_FinancialData:
         return True
 
 
+    # ----------- 导出（接口 / 录制 / 页面） ----------
+    async def export_bill(self, kind: str, page, month_str: str) -> bool:
+        """
+        导出一项，下载完校验 zip 完整后登记到下载清单
+        """
+        if not await self._export_bill(kind, page, month_str):
+            return False
+
+        path = self.export_path(month_str, kind)
+        if not verify_zip(path):
+            raise Exception(f"{kind} 下载的文件不完整: {path}")
+        self.manifest.record(path, self.shop_name, month_str, kind)
+        return True
+
+    async def _export_bill(self, kind: str, page, month_str: str) -> bool:
+        if self.mode == "api":
+            client = FinancialApiClient(self.shop_name, await self.context.cookies())
+            if client.has_template(kind):
+                try:
+                    await client.export(kind, month_str, self.export_path(month_str, kind))
+                    return True
+                except Exception as e:
+                    self.logger.warning(f"{self.shop_name} - {kind} 接口导出失败，改走页面流程: {e}")
+            else:
+                self.logger.info(f"{self.shop_name} - {kind} 还没有录制接口，走页面流程")
+
+        ui_export = self.get_other_bill if kind == "other_bill" else self.get_history_bill
+
+        if self.mode != "record":
+            return await ui_export(page, month_str)
+
+        recorder = ExportRecorder(kind, month_str)
+        recorder.attach(page)
+        try:
+            ok = await ui_export(page, month_str)
+        finally:
+            recorder.detach()
+
+        template = recorder.template()
+        if ok and template:
+            save_template(self.shop_name, kind, template)
+            self.logger.info(f"{self.shop_name} - {kind} 录制到 {len(template['steps'])} 个接口请求")
+        elif ok:
+            self.logger.warning(f"{self.shop_name} - {kind} 没有录制到导出接口")
+        return ok
+
+    async def export_month(self, month_str: str, kinds=tuple(EXPORT_FILES)) -> dict:
+        """
+        在当前登录会话里导出某个月，每项导出各用一个页面同时跑，各自等自己的下载
+
+        Returns:
+            kind -> True（成功）/ False / 异常
+        """
+        kinds = list(kinds)
+        pages = [self.page] + [await self.context.new_page() for _ in kinds[1:]]
+        results = await asyncio.gather(
+            *(self.export_bill(kind, page, month_str) for kind, page in zip(kinds, pages)),
+            return_exceptions=True,
+        )
+        # 本月打开的页面（含 Alipay 弹窗）关掉，下一个月继续用 self.page
+        await self.close_extra_pages()
+        return dict(zip(kinds, results))
+
     # -----------失败可以重新登录------------
     async def run_once(self):
         try:
@@ -387,21 +473,79 @@ class SMT_FinancialData:
             if not await self.login():
                 raise Exception("登录失败")
 
+            # 只导出清单里缺失或损坏的那几项（上次部分成功时只补剩下的）
+            kinds = [kind for _, kind in self.pending_exports([self.month_str])]
+            status = await self.export_month(self.month_str, kinds)
 
-            # 其他收支结算
-            if not await self.get_other_bill():
-                raise Exception('获取其他收支结算失败')
-
-            # 历史账单
-            if not await self.get_history_bill():
-                raise Exception("获取动账财务数据失败")
+            for kind, ok in status.items():
+                if ok is not True:
+                    raise Exception(f'获取{EXPORT_FILES[kind]}失败: {ok}')
 
         finally:
             # ✅ 无论成功失败，统一关
             await self.close()
 
+    async def backfill_once(self, pending: list, results: dict):
+        """
+        登录一次，在同一个会话里依次导出 pending 里的 (月份, kind)；成功的从 pending 里移除
+        """
+        try:
+            await self.start_browser()
+
+            if not await self.login():
+                raise Exception("登录失败")
+
+            months = sorted({month for month, _ in pending})
+            for month_str in months:
+                kinds = [kind for month, kind in pending if month == month_str]
+                self.logger.info(f"{self.shop_name} - 开始导出 {month_str}: {kinds}")
+
+                status = await self.export_month(month_str, kinds)
+                for kind, ok in status.items():
+                    if ok is True:
+                        results[(month_str, kind)] = "fetched"
+                        pending.remove((month_str, kind))
+                    else:
+                        self.logger.error(f"{self.shop_name} - {month_str} {kind} 导出失败: {ok}")
+
+            if pending:
+                raise Exception(f"还有 {len(pending)} 项没有导出")
+        finally:
+            await self.close()
+
+    async def run_backfill(self, items, max_retry=3) -> dict:
+        """
+        items: 要导出的 [(月份, kind), ...]；多个月份只登录一次，失败时重新登录，只补没成功的那些
+
+        Returns:
+            (月份, kind) -> "fetched" / "failed"
+        """
+        pending = list(items)
+        results = {}
+
+        self.logger.info(f"--------------------{self.shop_name} ------------------------ 补数 {len(pending)} 项")
+        for attempt in range(1, max_retry + 1):
+            if not pending:
+                break
+            try:
+                self.logger.info(f"{self.shop_name} - 第 {attempt} 次登录尝试")
+                await self.backfill_once(pending, results)
+            except Exception as e:
+                self.logger.error(f"{self.shop_name} - 第 {attempt} 次失败: {e}", exc_info=True)
+                await self.browser_service.discard(self.cloud_account_id)
+                if pending and attempt < max_retry:
+                    await asyncio.sleep(3)
+
+        for key in pending:
+            results[key] = "failed"
+        return results
+
     # ----------- 总流程 -----------
     async def run(self, max_retry=3):
+        if not self.pending_exports([self.month_str]):
+            self.logger.info(f"{self.shop_name} - {self.month_str} 的文件都已下载且校验通过，跳过")
+            return True
+
         self.logger.info(f"--------------------{self.shop_name} ------------------------ 开始登录...")
         for attempt in range(1, max_retry + 1):
             try:
@@ -411,7 +555,8 @@ class SMT_FinancialData:
                 return True
             except Exception as e:
                 self.logger.error(f"{self.shop_name} - 第 {attempt} 次失败: {e}", exc_info=True)
-                self.stop_cloud_browser()
+                # 出错后的浏览器状态不可信，关掉重来
+                await self.browser_service.discard(self.cloud_account_id)
                 if attempt < max_retry:
                     await asyncio.sleep(3)
 
@@ -419,14 +564,33 @@ class SMT_FinancialData:
         ding_bot_send('me',f"{self.shop_name} - financial任务登录失败，已达到最大重试次数 {max_retry}")
         return False
 
+    async def close_extra_pages(self):
+        """
+        关掉除 self.page 以外的页面（如 Alipay 弹窗）
+        """
+        pages = self.context.pages
+        keep = self.page or (pages[0] if pages else None)
+        for page in pages:
+            if page is not keep:
+                await page.close()
+
     async def close(self):
+        """
+        关掉本次打开的多余页面（如 Alipay 弹窗），把连接还给 BrowserService
+        """
+        if self.context is None:
+            return
         try:
-            if self.browser:
-                await self.browser.close()
-            if self.playwright:
-                await self.playwright.stop()
+            await self.close_extra_pages()
+        except Exception as e:
+            self.logger.warning(f"{self.shop_name} - 关闭页面失败: {e}")
         finally:
-            self.stop_cloud_browser()
+            if self.blocker:
+                await self.blocker.detach()
+                self.blocker = None
+            self.browser_service.release(self.cloud_account_id)
+            self.context = None
+            self.page = None
 
 
 # async def main():
@@ -0,0 +1,444 @@
+import argparse
+import codecs
+import csv
+import io
+import json
+import os
+import re
+import threading
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from decimal import Decimal, InvalidOperation
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional
+
+try:
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+    import pyarrow.parquet as pq
+except ImportError:  # 不入账本时不需要 pyarrow
+    pa = ds = pq = None
+
+try:
+    import openpyxl
+except ImportError:  # 只入财务动账（csv）时不需要 openpyxl
+    openpyxl = None
+
+from utils.logger import get_logger
+from utils.download_manifest import get_download_manifest, BASE_DIR
+
+"""财务导出入账本，内存只和 CHUNK_ROWS 有关，和文件大小无关
+
+- 财务动账 zip（history_bill）：不解压，逐个 csv 成员流式读取
+- 其他收支结算 xlsx（other_bill）：openpyxl 只读模式逐行读取
+
+写入 data/ledger/{kind}/shop={店铺}/month={YYYY-MM}/part-0.parquet，同一个店铺同一个月重跑会整体替换，天然幂等；
+每个源文件的行数和 sha256 记在 data/ledger/ingest_log.json，文件没变就不重复入账
+"""
+
+LEDGER_DIR = BASE_DIR / "data" / "ledger"
+INGEST_LOG_FILE = LEDGER_DIR / "ingest_log.json"
+
+CHUNK_ROWS = 50_000
+
+# 金额统一成 decimal(18, 4)
+AMOUNT_TYPE_ARGS = (18, 4)
+AMOUNT_QUANT = Decimal("0.0001")
+
+# 规范列名 -> 导出文件里可能出现的表头（中英文都有）
+COLUMN_ALIASES = {
+    "biz_time": ("入账时间", "交易时间", "发生时间", "创建时间", "时间", "Transaction Time", "Time", "Date"),
+    "biz_type": ("业务类型", "交易类型", "账务类型", "类型", "Type", "Transaction Type"),
+    "order_id": ("订单号", "业务订单号", "交易号", "流水号", "账务流水号", "Order No.", "Transaction ID"),
+    "description": ("备注", "摘要", "说明", "描述", "Remark", "Description"),
+    "currency": ("币种", "币种代码", "Currency"),
+    "amount": ("金额", "交易金额", "变动金额", "收支金额", "结算金额", "Amount"),
+    "income": ("收入", "收入金额", "收入（+）", "Income"),
+    "expense": ("支出", "支出金额", "支出（-）", "Expense"),
+    "balance": ("余额", "账户余额", "Balance"),
+}
+STRING_COLUMNS = ("biz_time", "biz_type", "order_id", "description", "currency")
+AMOUNT_COLUMNS = ("amount", "balance")
+
+# 表头里至少要认出的列，用来在说明文字里找到真正的表头行
+HEADER_REQUIRED = ("biz_time",)
+HEADER_ANY_AMOUNT = ("amount", "income", "expense")
+HEADER_SCAN_ROWS = 50
+
+logger = get_logger("ledger_ingest")
+
+
+class LedgerFormatError(Exception):
+    """导出文件里找不到表头，不能当作 0 行入账"""
+
+
+def _require_pyarrow():
+    if pa is None:
+        raise RuntimeError("写/读账本需要安装 pyarrow")
+
+
+def ledger_schema():
+    _require_pyarrow()
+    return pa.schema(
+        [("source_file", pa.string()), ("member", pa.string()), ("row_no", pa.int64())]
+        + [(name, pa.string()) for name in STRING_COLUMNS]
+        + [(name, pa.decimal128(*AMOUNT_TYPE_ARGS)) for name in AMOUNT_COLUMNS]
+    )
+
+
+def ledger_dir(kind: str, shop_name: str, month_str: str) -> Path:
+    return LEDGER_DIR / kind / f"shop={shop_name}" / f"month={month_str}"
+
+
+# ---------- 解析 ----------
+def _normalize_header(cell: str) -> str:
+    return re.sub(r"\s+", "", cell.strip().lstrip("﻿"))
+
+
+def match_header(row: List[str]) -> Optional[Dict[str, int]]:
+    """
+    是表头行就返回 规范列名 -> 列下标，否则 None
+    """
+    aliases = {
+        _normalize_header(alias): name
+        for name, names in COLUMN_ALIASES.items()
+        for alias in names
+    }
+    mapping = {}
+    for idx, cell in enumerate(row):
+        name = aliases.get(_normalize_header(cell))
+        if name and name not in mapping:
+            mapping[name] = idx
+
+    if all(k in mapping for k in HEADER_REQUIRED) and any(k in mapping for k in HEADER_ANY_AMOUNT):
+        return mapping
+    return None
+
+
+def parse_amount(value: Optional[str]) -> Optional[Decimal]:
+    """
+    '1,234.50' / '¥-12' / '(3.2)' / '' -> Decimal 或 None
+    """
+    if value is None:
+        return None
+    text = re.sub(r"[,\s¥$￥]|[A-Z]{3}", "", value.strip())
+    if text in ("", "-", "--"):
+        return None
+
+    negative = text.startswith("(") and text.endswith(")")
+    text = text.strip("()")
+    try:
+        amount = Decimal(text)
+    except InvalidOperation:
+        return None
+    if negative:
+        amount = -amount
+    return amount.quantize(AMOUNT_QUANT)
+
+
+def _open_text(zf: zipfile.ZipFile, member: str) -> io.TextIOWrapper:
+    """
+    支付宝导出有 utf-8（带 BOM）也有 gbk，先看开头一段能不能按 utf-8 解出来
+
+    用增量解码器：截断处落在多字节汉字中间时，末尾不完整的字节留着不报错
+    """
+    with zf.open(member) as f:
+        head = f.read(64 * 1024)
+    try:
+        codecs.getincrementaldecoder("utf-8-sig")().decode(head, final=False)
+        encoding = "utf-8-sig"
+    except UnicodeDecodeError:
+        encoding = "gb18030"
+    return io.TextIOWrapper(zf.open(member), encoding=encoding, errors="replace", newline="")
+
+
+def iter_member_rows(zf: zipfile.ZipFile, member: str) -> Iterator[dict]:
+    """
+    逐行产出规范化后的记录；表头之前的说明文字、表尾的汇计行都跳过
+
+    生成器的返回值：是否找到了表头
+    """
+    with _open_text(zf, member) as text:
+        reader = csv.reader(text)
+
+        mapping = None
+        for scanned, row in enumerate(reader):
+            mapping = match_header(row)
+            if mapping or scanned >= HEADER_SCAN_ROWS:
+                break
+        if not mapping:
+            logger.warning(f"{member} 没有找到表头，跳过")
+            return False
+
+        width = max(mapping.values()) + 1
+        for row_no, row in enumerate(reader, start=1):
+            if len(row) < width or row[0].lstrip().startswith("#"):
+                continue
+            record = normalize_row(row, mapping, member, row_no)
+            if record:
+                yield record
+    return True
+
+
+def _cell_text(value) -> Optional[str]:
+    if value is None:
+        return None
+    if isinstance(value, datetime):
+        return value.strftime("%Y-%m-%d %H:%M:%S")
+    text = str(value).strip()
+    return text or None
+
+
+def _cell_amount(value) -> Optional[Decimal]:
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, (int, float)):
+        # float 先转 str，避免二进制误差带进 Decimal
+        return Decimal(str(value)).quantize(AMOUNT_QUANT)
+    return parse_amount(value)
+
+
+def normalize_row(row, mapping: Dict[str, int], member: str, row_no: int) -> Optional[dict]:
+    """
+    csv / xlsx 共用：按表头映射取列，金额转 Decimal；没有时间的汇总、说明行返回 None
+    """
+    record = {name: _cell_text(row[mapping[name]]) for name in STRING_COLUMNS if name in mapping}
+    if not record.get("biz_time"):
+        return None
+
+    if "amount" in mapping:
+        amount = _cell_amount(row[mapping["amount"]])
+    else:
+        income = _cell_amount(row[mapping["income"]]) if "income" in mapping else None
+        expense = _cell_amount(row[mapping["expense"]]) if "expense" in mapping else None
+        amount = None
+        if income is not None or expense is not None:
+            amount = (income or Decimal(0)) - abs(expense or Decimal(0))
+
+    record["amount"] = amount
+    record["balance"] = _cell_amount(row[mapping["balance"]]) if "balance" in mapping else None
+    record["member"] = member
+    record["row_no"] = row_no
+    return record
+
+
+def iter_zip_rows(path: Path) -> Iterator[dict]:
+    """
+    一个 csv 成员都没认出表头时报错，不能当作空账单
+    """
+    found = False
+    with zipfile.ZipFile(path) as zf:
+        for member in zf.namelist():
+            if member.lower().endswith(".csv"):
+                found = (yield from iter_member_rows(zf, member)) or found
+    if not found:
+        raise LedgerFormatError(f"{path.name} 里没有找到表头")
+
+
+def iter_xlsx_rows(path: Path) -> Iterator[dict]:
+    """
+    只读模式逐行读每个 sheet，不把整个工作簿读进内存；所有 sheet 都没有表头时报错
+    """
+    if openpyxl is None:
+        raise RuntimeError("读取 xlsx 需要安装 openpyxl")
+
+    found = False
+    wb = openpyxl.load_workbook(path, read_only=True, data_only=True)
+    try:
+        for ws in wb.worksheets:
+            rows = ws.iter_rows(values_only=True)
+
+            mapping = None
+            for scanned, row in enumerate(rows):
+                mapping = match_header([_cell_text(v) or "" for v in row])
+                if mapping or scanned >= HEADER_SCAN_ROWS:
+                    break
+            if not mapping:
+                logger.warning(f"{path.name} / {ws.title} 没有找到表头，跳过")
+                continue
+
+            found = True
+            width = max(mapping.values()) + 1
+            for row_no, row in enumerate(rows, start=1):
+                if len(row) < width:
+                    continue
+                record = normalize_row(row, mapping, ws.title, row_no)
+                if record:
+                    yield record
+    finally:
+        wb.close()
+
+    if not found:
+        raise LedgerFormatError(f"{path.name} 里没有找到表头")
+
+
+# 各类导出文件的读取方式
+ROW_READERS = {
+    "history_bill": iter_zip_rows,
+    "other_bill": iter_xlsx_rows,
+}
+
+
+# ---------- 写入 ----------
+def _to_batch(rows: List[dict], source_file: str):
+    schema = ledger_schema()
+    columns = {
+        name: [r.get(name) for r in rows]
+        for name in schema.names
+        if name != "source_file"
+    }
+    columns["source_file"] = [source_file] * len(rows)
+    return pa.table({name: columns[name] for name in schema.names}, schema=schema)
+
+
+def ingest_file(path: Path, shop_name: str, month_str: str, kind: str) -> int:
+    """
+    把一个导出文件写成该店铺该月的账本分区，返回写入的行数
+    """
+    _require_pyarrow()
+    path = Path(path)
+
+    out_dir = ledger_dir(kind, shop_name, month_str)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    part_path = out_dir / "part-0.parquet"
+    # 以 "." 开头，读取时会被 pyarrow 忽略
+    tmp_path = out_dir / f".{part_path.name}.tmp"
+
+    total = 0
+    try:
+        with pq.ParquetWriter(tmp_path, ledger_schema(), compression="zstd") as writer:
+            chunk = []
+            for record in ROW_READERS[kind](path):
+                chunk.append(record)
+                if len(chunk) >= CHUNK_ROWS:
+                    writer.write_table(_to_batch(chunk, path.name))
+                    total += len(chunk)
+                    chunk = []
+            if chunk:
+                writer.write_table(_to_batch(chunk, path.name))
+                total += len(chunk)
+    except Exception:
+        # 读到一半出错（包括找不到表头）：不替换原来的分区，也不会记入入账记录
+        tmp_path.unlink(missing_ok=True)
+        raise
+
+    tmp_path.replace(part_path)
+    logger.info(f"{shop_name} {month_str} {kind} 入账 {total} 行: {path.name}")
+    return total
+
+
+def ingest_zip(zip_path: Path, shop_name: str, month_str: str) -> int:
+    return ingest_file(zip_path, shop_name, month_str, "history_bill")
+
+
+def ingest_xlsx(xlsx_path: Path, shop_name: str, month_str: str) -> int:
+    return ingest_file(xlsx_path, shop_name, month_str, "other_bill")
+
+
+# ---------- 入账记录 ----------
+_ingest_log_lock = threading.Lock()
+
+
+def load_ingest_log() -> dict:
+    if not INGEST_LOG_FILE.exists():
+        return {}
+    return json.loads(INGEST_LOG_FILE.read_text(encoding="utf-8"))
+
+
+def _save_ingest_log(entries: dict):
+    INGEST_LOG_FILE.parent.mkdir(parents=True, exist_ok=True)
+    tmp_file = INGEST_LOG_FILE.with_suffix(".json.tmp")
+    tmp_file.write_text(json.dumps(entries, ensure_ascii=False, indent=2), encoding="utf-8")
+    tmp_file.replace(INGEST_LOG_FILE)
+
+
+def _ingest_job(job: dict) -> dict:
+    """
+    进程池里执行：入账一个文件，返回入账记录
+    """
+    path = BASE_DIR / job["path"]
+    rows = ingest_file(path, job["shop"], job["month"], job["kind"])
+    return {
+        **job,
+        "rows": rows,
+        "ingested_at": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+    }
+
+
+def ingest_month(month_str: str, kinds=tuple(ROW_READERS), workers: Optional[int] = None, force: bool = False) -> Dict[str, int]:
+    """
+    按下载清单找出该月所有店铺的导出文件，用进程池并行入账（每个文件一个任务）
+
+    文件的 sha256 和上次入账时一样、分区也还在的跳过，除非 force=True
+
+    Returns:
+        文件相对路径 -> 行数
+    """
+    manifest = get_download_manifest().load()
+    done = load_ingest_log()
+
+    jobs = []
+    for rel_path, entry in sorted(manifest.items()):
+        if entry["kind"] not in kinds or entry["month"] != month_str:
+            continue
+
+        last = done.get(rel_path)
+        part_path = ledger_dir(entry["kind"], entry["shop"], month_str) / "part-0.parquet"
+        if not force and last and last["sha256"] == entry["sha256"] and part_path.exists():
+            logger.info(f"{rel_path} 已入账（{last['rows']} 行），跳过")
+            continue
+
+        jobs.append({
+            "path": rel_path,
+            "shop": entry["shop"],
+            "month": month_str,
+            "kind": entry["kind"],
+            "sha256": entry["sha256"],
+        })
+
+    if not jobs:
+        return {}
+
+    # 每个文件一个进程：xlsx 解析是纯 CPU，线程跑不满
+    workers = workers or min(len(jobs), os.cpu_count() or 1)
+    counts = {}
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = [(job, pool.submit(_ingest_job, job)) for job in jobs]
+        for job, future in futures:
+            try:
+                result = future.result()
+            except Exception as e:
+                logger.error(f"{job['path']} 入账失败: {e}", exc_info=True)
+                continue
+
+            counts[job["path"]] = result["rows"]
+            with _ingest_log_lock:
+                entries = load_ingest_log()
+                entries[job["path"]] = result
+                _save_ingest_log(entries)
+
+    return counts
+
+
+def read_ledger(kind: str = "history_bill", columns: Optional[List[str]] = None, filter=None):
+    """
+    按 shop / month 分区查询账本，例如：
+        read_ledger(columns=["shop", "month", "amount"], filter=ds.field("month") >= "2025-01")
+    """
+    _require_pyarrow()
+    dataset = ds.dataset(LEDGER_DIR / kind, format="parquet", partitioning="hive")
+    return dataset.to_table(columns=columns, filter=filter).to_pandas()
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="财务导出文件入账本")
+    parser.add_argument("--month", required=True, help="月份 YYYY-MM")
+    parser.add_argument("--workers", type=int, default=None, help="进程数，默认按文件数和 CPU 数")
+    parser.add_argument("--force", action="store_true", help="文件没变也重新入账")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    ingest_month(args.month, workers=args.workers, force=args.force)
@@ -1,13 +1,12 @@
-from playwright.async_api import async_playwright
-import json
-from pathlib import Path
+import re
+import time
 from datetime import datetime
-import requests
 import asyncio
 from utils.cookie_manager import get_shop_config
 from utils.dingtalk_bot import ding_bot_send
-
-COOKIE_DIR = Path(__file__).resolve().parent.parent / "data" / "cookies"
+from utils.browser_service import get_browser_service
+from utils.cookie_store import get_cookie_store
+from utils.request_blocker import RequestBlocker
 
 # ✅ AliExpress / Ali 系 cookies 白名单
 COOKIE_WHITELIST = {
@@ -45,6 +44,105 @@ COOKIE_WHITELIST = {
     '_baxia_sec_cookie_',
 }
 
+# 登录成功的标志：这几个 cookie 都出现在 context 里
+LOGIN_COOKIES = ('WDK_SESSID', '_m_h5_tk')
+
+# 已知的失败页面状态，出现就立即失败，不再等满超时
+LOGIN_ERROR_STATES = {
+    "账号或密码错误": re.compile(r"(密码错误|密码不正确|账号名或登录密码不正确|incorrect|Incorrect)"),
+}
+LOGIN_CAPTCHA_SELECTORS = (
+    '#nc_1_n1z',
+    '.nc_iconfont.btn_slide',
+    '#baxia-dialog-content',
+    'iframe[src*="punish"]',
+)
+LOGIN_RISK_URL_KEYWORDS = ('punish', '_____tmd_____', 'risk')
+
+LOGIN_POLL_INTERVAL = 0.3
+
+
+class LoginFailedError(Exception):
+    """登录页出现了确定的失败状态（密码错误 / 滑块 / 风控）"""
+
+
+async def _any_visible(locator) -> bool:
+    """
+    登录页会提前渲染隐藏的滑块、错误提示节点，只算真正显示出来的
+    """
+    for i in range(await locator.count()):
+        if await locator.nth(i).is_visible():
+            return True
+    return False
+
+
+async def _detect_login_error(page):
+    url = page.url
+    if any(k in url for k in LOGIN_RISK_URL_KEYWORDS):
+        return f"风控页面: {url}"
+
+    for selector in LOGIN_CAPTCHA_SELECTORS:
+        if await _any_visible(page.locator(selector)):
+            return "出现滑块验证"
+
+    for reason, pattern in LOGIN_ERROR_STATES.items():
+        if await _any_visible(page.get_by_text(pattern)):
+            return reason
+
+    return None
+
+
+async def current_session(context):
+    """
+    提交登录前 context 里已有的 WDK_SESSID
+    """
+    for c in await context.cookies():
+        if c['name'] == 'WDK_SESSID':
+            return c['value']
+    return None
+
+
+async def wait_for_login(
+        page,
+        required_cookies=LOGIN_COOKIES,
+        timeout: float = 60,
+        after_login=None,
+        stale_session: str = None,
+) -> dict:
+    """
+    提交账号密码后轮询 context 的 cookie，所需 cookie 都出现就返回；
+    出现已知失败状态时抛 LoginFailedError，超时抛 TimeoutError
+
+    after_login: 拿到 WDK_SESSID 但还缺其他 cookie 时调用一次（例如打开一个会发 mtop 请求的页面）
+    stale_session: 提交前 context 里已有的 WDK_SESSID（复用的浏览器里可能残留过期会话），不算登录成功
+
+    Returns:
+        context 里全部 cookie（name -> value）
+    """
+    deadline = time.monotonic() + timeout
+    kicked = False
+
+    while time.monotonic() < deadline:
+        cookies = {c['name']: c['value'] for c in await page.context.cookies()}
+        logged_in = cookies.get('WDK_SESSID') and cookies['WDK_SESSID'] != stale_session
+
+        if logged_in and all(cookies.get(name) for name in required_cookies):
+            return cookies
+
+        if logged_in:
+            if after_login and not kicked:
+                kicked = True
+                await after_login()
+        else:
+            # 还在登录页时才检查失败状态
+            reason = await _detect_login_error(page)
+            if reason:
+                raise LoginFailedError(reason)
+
+        await asyncio.sleep(LOGIN_POLL_INTERVAL)
+
+    raise TimeoutError(f"等待登录 cookie 超时（{timeout}s）: {required_cookies}")
+
 
 
 class SimpleLogin:
@@ -69,98 +167,72 @@ class SimpleLogin:
             if k in COOKIE_WHITELIST and v
         }
 
-    def start_cloud_browser(self) -> str:
-        url = "http://localhost:50213/api/v2/browser/start"
-        resp = requests.get(
-            url,
-            params={"account_id": self.cloud_account_id},
-            timeout=10
-        )
-        resp.raise_for_status()
-        return resp.json()["data"]["ws"]['puppeteer']
-
-    def stop_cloud_browser(self):
-        """
-        通过云浏览器 API 关闭浏览器实例
-        """
-        url = "http://localhost:50213/api/v2/browser/stop"
-        try:
-            resp = requests.get(
-                url,
-                params={"account_id": self.cloud_account_id},
-                timeout=10
-            )
-            resp.raise_for_status()
-            print(f"[{self.shop_name}] 云浏览器已关闭")
-        except Exception as e:
-            print(f"[{self.shop_name}] 关闭云浏览器失败: {e}")
-
     async def login_and_save_cookies(self) -> bool:
-        COOKIE_DIR.mkdir(parents=True, exist_ok=True)
-
-        ws_endpoint = self.start_cloud_browser()
-
-        async with async_playwright() as p:
-            browser = await p.chromium.connect_over_cdp(ws_endpoint)
-            context = browser.contexts[0]
-
-            page = context.pages[0] if context.pages else await context.new_page()
-            await page.bring_to_front()
-
-            login_url = (
-                "https://login.aliexpress.com/user/seller/login"
-                f"?bizSegment=CSP&channelId={self.channel_id}"
-            )
-
-            if "login" not in page.url:
-                await page.goto(login_url, wait_until="domcontentloaded")
-
-            user_input = page.locator('#loginName')
-            await user_input.wait_for(state='visible', timeout=15_000)
-            await user_input.fill(self.username)
-
-            password_input = page.locator('#password')
-            await password_input.wait_for(state='visible', timeout=15_000)
-            await password_input.fill(self.password)
-
-            await page.click('button[type="button"]:has-text("登录")')
-
-            try:
-                await page.wait_for_url("**/m_apps/**", timeout=300_000)
-            except Exception:
-                print(f"{self.shop_name} 登录失败")
-                return False
-
-            await page.goto(f'https://csp.aliexpress.com/m_apps/ascp/aechoice.inventory_distribution_details_management?channelId={self.channel_id}',wait_until="domcontentloaded")
+        # 复用进程内的 Playwright driver 和该账号的云浏览器连接
+        service = get_browser_service()
+        context = await service.acquire(self.cloud_account_id)
+        # 可选：不加载图片、字体、埋点（config.json 的 request_blocking）
+        blocker = RequestBlocker.from_config(name=f"{self.shop_name}-login")
+        ok = False
+        try:
+            if blocker:
+                await blocker.attach(context)
+            ok = await self._login_in_context(context)
+            return ok
+        finally:
+            if blocker:
+                await blocker.detach()
+            service.release(self.cloud_account_id)
+            if not ok:
+                # 失败时关闭云浏览器，下次重新启动
+                await service.discard(self.cloud_account_id)
+
+    async def _login_in_context(self, context) -> bool:
+        page = context.pages[0] if context.pages else await context.new_page()
+        await page.bring_to_front()
+
+        login_url = (
+            "https://login.aliexpress.com/user/seller/login"
+            f"?bizSegment=CSP&channelId={self.channel_id}"
+        )
 
-            # 等待元素可见
+        if "login" not in page.url:
+            await page.goto(login_url, wait_until="domcontentloaded")
 
-            await asyncio.sleep(6)
+        user_input = page.locator('#loginName')
+        await user_input.wait_for(state='visible', timeout=15_000)
+        await user_input.fill(self.username)
 
-            raw_cookies = await context.cookies()
-            cookies_dict = {c['name']: c['value'] for c in raw_cookies}
-            cookies_dict = self.filter_cookies(cookies_dict)
+        password_input = page.locator('#password')
+        await password_input.wait_for(state='visible', timeout=15_000)
+        await password_input.fill(self.password)
 
-            # ⚠️ 检查 WDK_SESSID 是否存在
-            if 'WDK_SESSID' not in cookies_dict:
-                print(f"[{self.shop_name}] 登录成功，但 WDK_SESSID 不存在，cookies 无效")
-                self.stop_cloud_browser()
-                return False
+        stale_session = await current_session(context)
+        await page.click('button[type="button"]:has-text("登录")')
 
-            cookie_data = {
-                "shop_name": self.shop_name,
-                "created_at": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-                "cookies_dict": cookies_dict,
-            }
+        async def open_inventory_page():
+            # _m_h5_tk 要等 csp 页面发出 mtop 请求后才会下发
+            await page.goto(f'https://csp.aliexpress.com/m_apps/ascp/aechoice.inventory_distribution_details_management?channelId={self.channel_id}',wait_until="commit")
 
-            cookie_file = COOKIE_DIR / f"{self.shop_name}.json"
-            cookie_file.write_text(
-                json.dumps(cookie_data, ensure_ascii=False, indent=2),
-                encoding="utf-8"
+        try:
+            cookies_dict = await wait_for_login(
+                page, after_login=open_inventory_page, stale_session=stale_session
             )
+        except (LoginFailedError, TimeoutError) as e:
+            print(f"{self.shop_name} 登录失败: {e}")
+            return False
 
-            self.stop_cloud_browser()
-            return True
+        cookies_dict = self.filter_cookies(cookies_dict)
 
+        # ⚠️ 检查 WDK_SESSID 是否存在
+        if 'WDK_SESSID' not in cookies_dict:
+            print(f"[{self.shop_name}] 登录成功，但 WDK_SESSID 不存在，cookies 无效")
+            return False
 
+        get_cookie_store().save(
+            self.shop_name,
+            cookies_dict,
+            created_at=datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        )
 
+        return True
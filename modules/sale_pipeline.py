@@ -0,0 +1,145 @@
+import asyncio
+import time
+
+from modules.smt_stock import SMTStockSpider
+from modules.sale_records import build_records, is_zero_row
+from utils.dingding_doc import DingTalkSheetUploader, DingTalkTokenManager
+from utils.goods_catalog import GoodsCatalog
+from utils.logger import get_logger
+
+"""库存抓取 → sku 匹配 → 钉钉上传 流式执行，抓取和上传同时进行"""
+
+
+class SalePipeline:
+    def __init__(self, shop_name: str, config: dict, batch_size: int = 50,
+                 write_csv: bool = False, queue_size: int = 10):
+        """
+        Args:
+            shop_name: 店铺名
+            config: 钉钉多维表配置（base_id / sheet_id / operator_id）
+            batch_size: 每批上传的记录数
+            write_csv: 是否同时写当天的库存 csv（旁路输出）
+            queue_size: 抓取与上传之间最多缓冲的页数
+        """
+        self.shop_name = shop_name
+        self.config = config
+        self.batch_size = batch_size
+        self.write_csv = write_csv
+        self.queue_size = queue_size
+
+        self.spider = SMTStockSpider(shop_name)
+        self.catalog = GoodsCatalog(shop_name)
+        self.uploader = None
+        self.logger = get_logger("sale_pipeline")
+
+        self.uploaded = 0
+        self.failed_batches = 0
+
+    # ---------- 上传 ----------
+    async def _upload(self, records):
+        if not records:
+            return
+
+        # 钉钉上传是同步 requests，放到线程里，抓取继续进行
+        results = await asyncio.to_thread(
+            self.uploader.upload_batch_records, records, self.batch_size, 0, 2
+        )
+        failed = [r for r in results if not r.get("success")]
+        for r in failed:
+            self.logger.error(f"[{self.shop_name}] 批次上传失败: {r.get('message', '未知错误')}")
+
+        self.failed_batches += len(failed)
+        self.uploaded += len(records)
+
+    # ---------- 生产 ----------
+    async def _produce(self, queue: asyncio.Queue):
+        try:
+            async for _, items in self.spider.iter_pages():
+                await queue.put(items)
+        except asyncio.CancelledError:
+            # 消费者已经退出，不需要结束标记
+            raise
+        except Exception:
+            # 出错也要让消费者退出
+            await queue.put(None)
+            raise
+
+        await queue.put(None)
+
+    # ---------- 消费 ----------
+    async def _consume(self, queue: asyncio.Queue):
+        buffer = []
+        # 目录里没有的货号ID，等抓取结束后增量同步目录再上传
+        deferred = []
+
+        while True:
+            items = await queue.get()
+            if items is None:
+                break
+
+            if self.write_csv:
+                self.spider.save_items(items)
+
+            ready = []
+            for row in items:
+                if is_zero_row(row):
+                    continue
+                if str(row['货号ID']) in self.catalog.skus:
+                    ready.append(row)
+                else:
+                    deferred.append(row)
+
+            buffer.extend(build_records(ready, self.catalog.skus))
+            while len(buffer) >= self.batch_size:
+                batch, buffer = buffer[:self.batch_size], buffer[self.batch_size:]
+                await self._upload(batch)
+
+        if deferred:
+            self.logger.info(f"[{self.shop_name}] {len(deferred)} 条库存的货号ID不在商品目录中，同步目录")
+            await self.catalog.sync(wanted_ids={row['货号ID'] for row in deferred})
+            buffer.extend(build_records(deferred, self.catalog.skus))
+
+        await self._upload(buffer)
+
+    # ---------- 主流程 ----------
+    async def run(self) -> int:
+        """
+        Returns:
+            上传的记录数
+        """
+        start = time.perf_counter()
+
+        token_manager = DingTalkTokenManager()
+        self.uploader = await asyncio.to_thread(
+            DingTalkSheetUploader,
+            self.config["base_id"],
+            self.config["sheet_id"],
+            self.config["operator_id"],
+            token_manager,
+        )
+
+        # 到期的全量刷新要在开始前做完，否则每一页都会被延后
+        if self.catalog.needs_full_refresh():
+            await self.catalog.sync(force_full=True)
+
+        queue = asyncio.Queue(maxsize=self.queue_size)
+        producer = asyncio.create_task(self._produce(queue))
+        try:
+            await self._consume(queue)
+        except BaseException:
+            producer.cancel()
+            await asyncio.gather(producer, return_exceptions=True)
+            raise
+        await producer
+
+        if not self.spider.completed:
+            raise RuntimeError("库存抓取中途失败，已上传部分数据")
+
+        self.logger.info(
+            f"[{self.shop_name}] 流式上传完成：{self.uploaded} 条，失败批次 {self.failed_batches}，"
+            f"耗时 {time.perf_counter() - start:.1f}s"
+        )
+        if self.failed_batches:
+            raise RuntimeError(f"{self.failed_batches} 个批次上传失败")
+
+        return self.uploaded
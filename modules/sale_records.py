@@ -0,0 +1,49 @@
+"""库存行 + sku → 钉钉多维表上传记录"""
+
+# 这几列全为 0 的商品不上传
+ZERO_CHECK_FIELDS = ['今日销量', '近7天销量', '近30天销量', '平台库存', '在途库存']
+
+# 上传到钉钉的字段（sku 单独处理）
+RECORD_FIELDS = ['商品名称', '抓取数据日期', '今日销量', '近7天销量', '近30天销量', '平台库存', '平台', '在途库存', '店铺']
+
+
+def is_zero_row(row) -> bool:
+    """
+    row: dict 或 pandas 的行
+    """
+    return all(row[field] == 0 for field in ZERO_CHECK_FIELDS)
+
+
+def build_record(row, sku) -> dict:
+    record = {field: row[field] for field in RECORD_FIELDS}
+    record["sku"] = sku
+    return record
+
+
+def build_records(rows, sku_map) -> list:
+    """
+    rows: 库存爬虫 parse_page 的结果
+    sku_map: 货号ID → sku
+    """
+    records = []
+    for row in rows:
+        if is_zero_row(row):
+            continue
+        records.append(build_record(row, sku_map.get(str(row['货号ID']), "")))
+    return records
+
+
+def build_records_frame(df) -> list:
+    """
+    向量化版本：df 为库存与 sku 合并后的 DataFrame，一次生成上传记录
+
+    与逐行版本结果一致：五列全为 0 的行跳过，sku 为空时填 ""
+    """
+    keep = ~(df[ZERO_CHECK_FIELDS] == 0).all(axis=1)
+    kept = df.loc[keep]
+
+    out = kept[RECORD_FIELDS].copy()
+    out["sku"] = kept["sku"].where(kept["sku"].notna(), "").astype(str)
+
+    # 转成 object 再导出，记录里是 Python 原生类型（json 序列化不会遇到 numpy 类型）
+    return out.astype(object).to_dict("records")
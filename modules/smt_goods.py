@@ -9,13 +9,25 @@ import asyncio
 
 from utils.cookie_manager import CookieManager
 from utils.logger import get_logger
+from utils.rate_limiter import get_rate_limiter
+from utils.crawl_checkpoint import CrawlCheckpoint
+from utils.snapshot_store import write_snapshot
+from utils.crawl_errors import (
+    CrawlError, TransportError, MalformedPayloadError,
+    call_with_retry, check_http_status, check_mtop_result, check_login_page,
+)
 
 
 class SMTGoodsSpider:
-    def __init__(self, shop_name: str):
+    def __init__(self, shop_name: str, formats=("csv",)):
+        """
+        formats: 落盘格式，csv / parquet 可多选
+        """
         self.shop_name = shop_name
+        self.formats = formats
         self.cookie_manager = CookieManager(shop_name)
         self.logger = get_logger("smt_goods")
+        self.rate_limiter = get_rate_limiter()
 
         self.url = (
             "https://seller-acs.aliexpress.com/"
@@ -32,25 +44,8 @@ class SMTGoodsSpider:
         }
 
         self.total_pages = 1
-
-    def is_cookie_invalid(self, json_data):
-        """
-        统一判断 cookie 是否失效
-        """
-
-        # 请求异常
-        if not json_data:
-            return True
-
-        if not isinstance(json_data, dict):
-            return True
-
-        # get_info 主动标记
-        if 'FAIL_SYS_TOKEN_EXOIRED' in json_data['ret'][0]:
-            return True
-
-
-        return False
+        # 本次 run 是否正常结束（没有因为多次失败而中断）
+        self.completed = False
 
     # ---------- 签名 ----------
     def make_sign(self, token, ts, app_key, data):
@@ -93,31 +88,28 @@ class SMTGoodsSpider:
         }
 
         try:
-
             resp = requests.post(
                 self.url,
                 cookies=cookies,
                 headers=self.headers,
                 params=params,
+                allow_redirects=False,
                 timeout=15,
             )
-            print(resp.text[:200])
+        except requests.RequestException as e:
+            raise TransportError(f'请求响应失败:{e}') from e
 
-            if resp.status_code != 200:
-                return None
+        self.logger.debug(f"[{self.shop_name}] 第{page}页返回: {resp.text[:200]}")
+        check_http_status(resp.status_code)
 
+        try:
             result = resp.json()
-        except Exception as e:
-            self.logger.error(f'请求响应失败:{e}')
-
-        # 👇 关键：token / session 失效判定
-        ret = result.get("ret", [])
-        if ret and isinstance(ret, list):
-            code = ret[0]
-            if "FAIL_SYS_TOKEN" in code or "SESSION_EXPIRED" in code:
-                return "COOKIE_EXPIRED"
+        except ValueError as e:
+            check_login_page(resp.text)
+            raise MalformedPayloadError(f'返回不是 JSON: {resp.text[:200]}') from e
 
-        return result
+        # 👇 关键：token 失效 / 限流 / 格式异常 分类抛出；token 过期时带上 Set-Cookie 里的新 token
+        return check_mtop_result(result, resp.cookies.get_dict())
 
     # ---------- 解析 ----------
     def parse_page(self, data):
@@ -143,11 +135,13 @@ class SMTGoodsSpider:
         return items
 
     # ---------- 保存 ----------
-    def save_items(self, items):
+    def output_file(self):
         out_dir = Path(__file__).resolve().parent.parent / "data" / "sale"
-        out_dir.mkdir(parents=True, exist_ok=True)
+        return out_dir / f"{self.shop_name}_goods_{datetime.now():%Y%m%d}.csv"
 
-        fname = out_dir / f"{self.shop_name}_goods_{datetime.now():%Y%m%d}.csv"
+    def save_items(self, items):
+        fname = self.output_file()
+        fname.parent.mkdir(parents=True, exist_ok=True)
         exists = fname.exists()
 
         with open(fname, "a", newline="", encoding="utf-8-sig") as f:
@@ -156,61 +150,91 @@ class SMTGoodsSpider:
                 writer.writeheader()
             writer.writerows(items)
 
+    def save_page(self, checkpoint, page, items):
+        """
+        去重后按 formats 落盘，再记录进度（parquet 按页覆盖写，放在 csv 之前）
+        """
+        new_items = checkpoint.filter_new(items)
+        if new_items:
+            if "parquet" in self.formats:
+                write_snapshot("goods", self.shop_name, page, new_items)
+            if "csv" in self.formats:
+                self.save_items(new_items)
+        checkpoint.commit(page, new_items)
+
     # ---------- 主流程 ----------
-    async def run(self):
+    async def run(self, wanted_ids=None, save=True):
+        """
+        wanted_ids: 只需要找到这些货号ID时传入，全部找到后提前结束
+        save: 是否写入当天的 csv（写 csv 时按当天进度断点续爬）
+
+        Returns:
+            本次抓到的 [{"货号ID", "sku"}, ...]
+        """
         self.logger.info(f'正在爬取店铺------{self.shop_name}------的数据')
         page = 1
-        max_retry = 3
+
+        collected = []
+        remaining = {str(i) for i in wanted_ids} if wanted_ids is not None else None
+        self.completed = False
+
+        checkpoint = None
+        if save:
+            checkpoint = CrawlCheckpoint(self.shop_name, "goods")
+            if checkpoint.done:
+                self.logger.info(f"[{self.shop_name}] 今天的商品数据已经抓完，跳过")
+                self.completed = True
+                return collected
+            checkpoint.reconcile(self.output_file())
+            page = checkpoint.next_page
+            if page > 1:
+                self.logger.info(f"[{self.shop_name}] 从第 {page} 页继续抓取")
 
         while True:
-            data = None
-            for attempt in range(1,max_retry+1):
-                try:
-                    cookies,token = await self.cookie_manager.get_auth()
-                    # 请求响应数据
-                    data = self.fetch_page(cookies, token, page)
-
-                    # ⭐ 核心：统一失效判断
-                    if self.is_cookie_invalid(data):
-                        raise PermissionError("cookie 已失效或接口异常")
-                    # 成功直接跳出 retry
-                    break
-                except PermissionError as e:
-                    self.logger.warning(
-                        f"[{self.shop_name}] 第 {page} 页 cookie 失效，刷新中（{attempt}/{max_retry}）"
-                    )
-                    await self.cookie_manager.refresh()
-                    await asyncio.sleep(2)
-
-                except Exception as e:
-                    self.logger.error(
-                        f"[{self.shop_name}] 第 {page} 页请求异常（{attempt}/{max_retry}）：{e}"
-                    )
-                    await self.cookie_manager.refresh()
-                    await asyncio.sleep(2)
-
-            # ---------- retry 全失败 ----------
-            if not data:
+            async def fetch():
+                cookies, token = await self.cookie_manager.get_auth()
+                await self.rate_limiter.acquire(self.url)
+                # requests 是阻塞的，放到线程里执行，不卡住事件循环（多店铺并发）
+                return await asyncio.to_thread(self.fetch_page, cookies, token, page)
+
+            try:
+                # 只有登录失效才刷新 cookie（token 过期先 HTTP 续期），网络错误 / 限流只退避重试
+                data = await call_with_retry(
+                    fetch, self.cookie_manager.handle_auth_expired, self.logger, f"[{self.shop_name}] 第 {page} 页"
+                )
+            except CrawlError as e:
+                # ---------- retry 全失败 ----------
                 self.logger.error(
-                    f"[{self.shop_name}] 第 {page} 页多次失败，终止任务"
+                    f"[{self.shop_name}] 第 {page} 页多次失败，终止任务：{e}"
                 )
                 break
 
             # 解析数据
             items = self.parse_page(data)
+            collected.extend(items)
 
-            if items:
-                self.save_items(items)
+            if checkpoint:
+                self.save_page(checkpoint, page, items)
 
             self.logger.info(f"[{self.shop_name}] 第 {page} 页 {len(items)} 条---保存成功")
 
             if page >= self.total_pages:
                 print('数据爬取完毕')
+                self.completed = True
+                if checkpoint:
+                    checkpoint.finish()
                 break
 
+            if remaining is not None:
+                remaining -= {str(i["货号ID"]) for i in items}
+                if not remaining:
+                    self.logger.info(f"[{self.shop_name}] 需要的货号ID已全部找到，提前结束")
+                    self.completed = True
+                    break
+
             page += 1
 
-            time.sleep(1)
+        return collected
 
 
 # async def main():
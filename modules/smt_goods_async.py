@@ -9,13 +9,25 @@ from pathlib import Path
 
 from utils.cookie_manager import CookieManager
 from utils.logger import get_logger
+from utils.rate_limiter import get_rate_limiter
+from utils.crawl_checkpoint import CrawlCheckpoint
+from utils.snapshot_store import write_snapshot
+from utils.crawl_errors import (
+    CrawlError, TransportError, MalformedPayloadError,
+    call_with_retry, check_http_status, check_mtop_result, check_login_page,
+)
 
 
 class SMTGoodsSpiderAsync:
-    def __init__(self, shop_name: str):
+    def __init__(self, shop_name: str, max_concurrency: int = 5, formats=("csv",)):
+        """
+        formats: 落盘格式，csv / parquet 可多选
+        """
         self.shop_name = shop_name
+        self.formats = formats
         self.cookie_manager = CookieManager(shop_name)
         self.logger = get_logger(f"SMTGoods-{shop_name}")
+        self.rate_limiter = get_rate_limiter()
 
         self.url = (
             "https://seller-acs.aliexpress.com/"
@@ -34,6 +46,12 @@ class SMTGoodsSpiderAsync:
 
         self.total_pages = 1
 
+        # 并发模式参数
+        self.max_concurrency = max_concurrency
+        self._semaphore = None
+        self._auth_lock = None
+        self._token = None
+
     # ---------- 签名 ----------
     def make_sign(self, token, ts, app_key, data):
         raw = f"{token}&{ts}&{app_key}&{data}"
@@ -72,27 +90,25 @@ class SMTGoodsSpiderAsync:
                 self.url,
                 headers=self.headers,
                 params=params,
+                allow_redirects=False,
                 timeout=aiohttp.ClientTimeout(total=15),
             ) as resp:
+                check_http_status(resp.status)
 
-                if resp.status != 200:
-                    self.logger.error(f"HTTP 状态异常: {resp.status}")
-                    return None
-
-                result = await resp.json()
+                text = await resp.text()
+                try:
+                    result = json.loads(text)
+                except ValueError as e:
+                    check_login_page(text)
+                    raise MalformedPayloadError(f"返回不是 JSON: {e}") from e
 
-        except Exception as e:
-            self.logger.error(f"请求异常: {e}")
-            return None
+                set_cookies = {name: morsel.value for name, morsel in resp.cookies.items()}
 
-        # 👇 token / session 失效判定
-        ret = result.get("ret", [])
-        if ret and isinstance(ret, list):
-            code = ret[0]
-            if "FAIL_SYS_TOKEN" in code or "SESSION_EXPIRED" in code:
-                return "COOKIE_EXPIRED"
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            raise TransportError(f"请求异常: {e}") from e
 
-        return result
+        # 👇 token 失效 / 限流 / 格式异常 分类抛出；token 过期时带上 Set-Cookie 里的新 token
+        return check_mtop_result(result, set_cookies)
 
     # ---------- 解析 ----------
     def parse_page(self, data, page):
@@ -116,11 +132,13 @@ class SMTGoodsSpiderAsync:
         return items
 
     # ---------- 保存 ----------
-    def save_items(self, items):
+    def output_file(self):
         out_dir = Path(__file__).resolve().parent.parent / "data" / "sale"
-        out_dir.mkdir(parents=True, exist_ok=True)
+        return out_dir / f"{self.shop_name}_goods_{datetime.now():%Y%m%d}.csv"
 
-        fname = out_dir / f"{self.shop_name}_goods_{datetime.now():%Y%m%d}.csv"
+    def save_items(self, items):
+        fname = self.output_file()
+        fname.parent.mkdir(parents=True, exist_ok=True)
         exists = fname.exists()
 
         with open(fname, "a", newline="", encoding="utf-8-sig") as f:
@@ -129,44 +147,61 @@ class SMTGoodsSpiderAsync:
                 writer.writeheader()
             writer.writerows(items)
 
-    # ---------- 主流程 ----------
-    async def run(self):
-        self.logger.info(f"正在爬取店铺 ------ {self.shop_name} ------ 的数据")
+    # ---------- 断点 ----------
+    def open_checkpoint(self):
+        """
+        返回今天的进度；已经抓完则返回 None
+        """
+        checkpoint = CrawlCheckpoint(self.shop_name, "goods")
+        if checkpoint.done:
+            self.logger.info(f"[{self.shop_name}] 今天的商品数据已经抓完，跳过")
+            return None
 
-        cookies, token = await self.cookie_manager.get_auth()
+        checkpoint.reconcile(self.output_file())
+        if checkpoint.last_page:
+            self.logger.info(f"[{self.shop_name}] 从第 {checkpoint.next_page} 页继续抓取")
+        return checkpoint
+
+    def save_page(self, checkpoint, page, items):
+        """
+        去重后按 formats 落盘，再记录进度（parquet 按页覆盖写，放在 csv 之前）
+        """
+        new_items = checkpoint.filter_new(items)
+        if new_items:
+            if "parquet" in self.formats:
+                write_snapshot("goods", self.shop_name, page, new_items)
+            if "csv" in self.formats:
+                self.save_items(new_items)
+        checkpoint.commit(page, new_items)
 
-        page = 1
-        retry = False
+    # ---------- 主流程 ----------
+    async def run(self, concurrent: bool = False):
+        if concurrent:
+            return await self.run_concurrent()
 
-        async with aiohttp.ClientSession(cookies=cookies) as session:
+        self.logger.info(f"正在爬取店铺 ------ {self.shop_name} ------ 的数据")
 
-            while True:
-                data = await self.fetch_page(session, token, page)
+        checkpoint = self.open_checkpoint()
+        if checkpoint is None:
+            return
 
-                # ---------- cookie 失效 ----------
-                if data == "COOKIE_EXPIRED":
-                    if retry:
-                        raise RuntimeError("cookie 刷新后仍然失效")
+        self._semaphore = asyncio.Semaphore(1)
+        self._auth_lock = asyncio.Lock()
 
-                    self.logger.warning(
-                        f"[{self.shop_name}] cookie 失效，重新登录中..."
-                    )
-                    await self.cookie_manager.refresh()
-                    cookies, token = await self.cookie_manager.get_auth()
+        cookies, self._token = await self.cookie_manager.get_auth()
 
-                    # 更新 session cookie
-                    session.cookie_jar.clear()
-                    session.cookie_jar.update_cookies(cookies)
+        page = checkpoint.next_page
 
-                    retry = True
-                    continue  # 👈 用新 cookie 重试当前页
+        async with aiohttp.ClientSession(cookies=cookies) as session:
 
-                if not data:
-                    self.logger.error("请求失败，终止任务")
+            while True:
+                try:
+                    items = await self._fetch_page_with_refresh(session, page)
+                except CrawlError as e:
+                    self.logger.error(f"[{self.shop_name}] 第 {page} 页多次失败，终止任务：{e}")
                     return
 
-                items = self.parse_page(data, page)
-                self.save_items(items)
+                self.save_page(checkpoint, page, items)
 
                 self.logger.info(
                     f"[{self.shop_name}] 第 {page} 页 {len(items)} 条 —— 保存成功"
@@ -174,8 +209,115 @@ class SMTGoodsSpiderAsync:
 
                 if page >= self.total_pages:
                     self.logger.info("🎉 数据爬取完毕")
+                    checkpoint.finish()
                     break
 
                 page += 1
-                retry = False
-                await asyncio.sleep(1)
+
+    # ---------- 登录失效 ----------
+    async def _refresh_auth(self, session, stale_token, error=None):
+        """
+        所有在途页面共用一次刷新：拿锁后如果 token 已经被别的页换掉，直接复用
+
+        token 过期先 HTTP 续期，会话失效才重新登录
+        """
+        async with self._auth_lock:
+            if self._token != stale_token:
+                return
+
+            self.logger.warning(f"[{self.shop_name}] 登录态失效（{error}），刷新中...")
+            await self.cookie_manager.handle_auth_expired(error)
+            cookies, token = await self.cookie_manager.get_auth()
+
+            session.cookie_jar.clear()
+            session.cookie_jar.update_cookies(cookies)
+            self._token = token
+
+    async def _fetch_page_with_refresh(self, session, page):
+        """
+        按错误类别重试；只有登录失效才走（共享的）cookie 刷新
+        """
+        token = None
+
+        async def fetch():
+            nonlocal token
+            await self.rate_limiter.acquire(self.url)
+            async with self._semaphore:
+                token = self._token
+                return await self.fetch_page(session, token, page)
+
+        async def on_auth_expired(error):
+            await self._refresh_auth(session, token, error)
+
+        data = await call_with_retry(fetch, on_auth_expired, self.logger, f"[{self.shop_name}] 第 {page} 页")
+        return self.parse_page(data, page)
+
+    # ---------- 并发模式 ----------
+    @staticmethod
+    async def _cancel_tasks(tasks):
+        for task in tasks.values():
+            task.cancel()
+        await asyncio.gather(*tasks.values(), return_exceptions=True)
+
+    async def run_concurrent(self):
+        """
+        先抓第 1 页拿到 totalPages，再并发抓 2..N 页，按页码顺序落盘
+        """
+        self.logger.info(
+            f"正在并发爬取店铺 ------ {self.shop_name} ------ 的数据（并发 {self.max_concurrency}）"
+        )
+        start = time.perf_counter()
+
+        checkpoint = self.open_checkpoint()
+        if checkpoint is None:
+            return
+
+        self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        self._auth_lock = asyncio.Lock()
+
+        cookies, self._token = await self.cookie_manager.get_auth()
+
+        async with aiohttp.ClientSession(cookies=cookies) as session:
+            # 第 1 页总要抓，用来拿 totalPages；失败时和串行模式一样记日志后结束
+            try:
+                items = await self._fetch_page_with_refresh(session, 1)
+            except CrawlError as e:
+                self.logger.error(f"[{self.shop_name}] 第 1 页多次失败，终止任务：{e}")
+                return
+            if checkpoint.last_page < 1:
+                self.save_page(checkpoint, 1, items)
+            total_pages = self.total_pages
+            first_page = max(2, checkpoint.next_page)
+
+            tasks = {
+                page: asyncio.create_task(self._fetch_page_with_refresh(session, page))
+                for page in range(first_page, total_pages + 1)
+            }
+
+            page = first_page
+            try:
+                # 按页码顺序等待，保证写入顺序与串行一致，进度只记连续成功的页
+                for page in range(first_page, total_pages + 1):
+                    items = await tasks[page]
+                    self.save_page(checkpoint, page, items)
+                    self.logger.info(
+                        f"[{self.shop_name}] 第 {page}/{total_pages} 页 {len(items)} 条 —— 保存成功"
+                    )
+            except CrawlError as e:
+                # 与串行模式一致：记下失败的页后结束，下次从断点继续
+                self.logger.error(f"[{self.shop_name}] 第 {page} 页多次失败，终止任务：{e}")
+                await self._cancel_tasks(tasks)
+                return
+            except Exception as e:
+                self.logger.error(f"[{self.shop_name}] 第 {page} 页出错，终止任务：{e}")
+                await self._cancel_tasks(tasks)
+                raise
+
+        checkpoint.finish()
+
+        cost = time.perf_counter() - start
+        fetched_pages = len(tasks) + 1
+        self.logger.info(
+            f"🎉 [{self.shop_name}] 数据爬取完毕：共 {total_pages} 页，本次抓取 {fetched_pages} 页，"
+            f"耗时 {cost:.1f}s，{fetched_pages / cost if cost else 0:.2f} 页/秒"
+        )
@@ -1,18 +1,30 @@
 import json
 import asyncio
-import requests
+import aiohttp
 from utils.cookie_manager import CookieManager
 import time
 from pathlib import Path
 from datetime import datetime
 import csv
 from utils.logger import get_logger
+from utils.rate_limiter import get_rate_limiter
+from utils.crawl_checkpoint import CrawlCheckpoint
+from utils.snapshot_store import write_snapshot
+from utils.crawl_errors import (
+    CrawlError, TransportError, MalformedPayloadError,
+    call_with_retry, check_http_status, check_scm_result, check_login_page,
+)
 
 class SMTStockSpider:
-    def __init__(self, shop_name: str,):
+    def __init__(self, shop_name: str, formats=("csv",)):
+        """
+        formats: 落盘格式，csv / parquet 可多选
+        """
         self.shop_name = shop_name
+        self.formats = formats
         self.cookie_manager = CookieManager(shop_name)
         self.logger = get_logger(f"SMTGoods-{shop_name}")
+        self.rate_limiter = get_rate_limiter()
         self.url = (
             "https://scm-supplier.aliexpress.com/"
             "aidc-aic-console/aic-inventory-manage/getRealTimeInvWithClearanceInfo"
@@ -20,32 +32,10 @@ class SMTStockSpider:
         self.headers = {
             'user-agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/127.0.0.0 Safari/537.36',
         }
-
-    def is_cookie_invalid(self, json_data):
-        """
-        统一判断 cookie 是否失效
-        """
-
-        # 请求异常
-        if not json_data:
-            return True
-
-
-        # get_info 主动标记
-        if json_data == "COOKIE_EXPIRED":
-            return True
-
-        if 401 in json_data:
-            self.logger.info('cookie无效')
-            return True
-
-        if not isinstance(json_data, dict):
-            return True
-
-        return False
+        self.completed = False
 
     # ---------- 请求 ----------
-    def fetch_page(self, cookies,page_index: int):
+    async def fetch_page(self, session, page_index: int):
         self.logger.info(f'正在爬取第{page_index}页')
         """发起HTTP请求获取数据"""
         payload = {
@@ -57,21 +47,36 @@ class SMTStockSpider:
         }
 
         try:
-            response = requests.post(
-                url=self.url,
+            async with session.post(
+                self.url,
                 headers=self.headers,
-                cookies=cookies,
                 json=payload,
-                timeout=30
-            )
-            print(response.text[:200])
+                allow_redirects=False,
+                timeout=aiohttp.ClientTimeout(total=30),
+            ) as response:
+                text = await response.text()
+                self.logger.debug(f"[{self.shop_name}] 第{page_index}页返回: {text[:200]}")
+
+                check_http_status(response.status)
+
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            raise TransportError(f'请求响应数据失败:{e}') from e
 
-            data=response.json()
+        try:
+            data = json.loads(text)
+        except ValueError as e:
+            check_login_page(text)
+            raise MalformedPayloadError(f'返回不是 JSON: {text[:200]}') from e
 
-            return data
+        # 登录失效 / 限流 / 格式异常 分类抛出
+        return check_scm_result(data)
 
-        except Exception as e:
-            self.logger.error(f'请求响应数据失败:{e}')
+    def create_session(self, cookies):
+        """
+        每个店铺一个连接池，keep-alive 复用 TCP/TLS 连接
+        """
+        connector = aiohttp.TCPConnector(limit=4, keepalive_timeout=60)
+        return aiohttp.ClientSession(cookies=cookies, connector=connector)
 
     # ---------- 解析 ----------
     def parse_page(self,json_data):
@@ -101,12 +106,14 @@ class SMTStockSpider:
 
         return items
 
-    def save_items(self, items):
+    def output_file(self):
         out_dir = Path(__file__).resolve().parent.parent / "data" / "sale"
-        self.logger.info(out_dir)
-        out_dir.mkdir(parents=True, exist_ok=True)
+        return out_dir / f"{self.shop_name}_stock_{datetime.now():%Y%m%d}.csv"
 
-        fname = out_dir / f"{self.shop_name}_stock_{datetime.now():%Y%m%d}.csv"
+    def save_items(self, items):
+        fname = self.output_file()
+        self.logger.info(fname.parent)
+        fname.parent.mkdir(parents=True, exist_ok=True)
         exists = fname.exists()
 
         with open(fname, "a", newline="", encoding="utf-8-sig") as f:
@@ -115,56 +122,83 @@ class SMTStockSpider:
                 writer.writeheader()
             writer.writerows(items)
 
-    async def run(self):
+    async def iter_pages(self, start_page: int = 1):
+        """
+        逐页产出 (页码, 解析后的数据)（异步生成器），不落盘
+
+        正常翻到最后一页时 self.completed 为 True，中途多次失败为 False
+        """
         self.logger.info(f'正在爬取店铺-------{self.shop_name}------的数据')
 
-        page_index = 1
+        page_index = start_page
+        self.completed = False
 
-        max_retry=3
+        cookies, _ = await self.cookie_manager.get_auth()
 
-        while True:
-            json_data=None
-            for attempt in range(1, max_retry + 1):
-                try:
-                    cookies, token = await self.cookie_manager.get_auth()
-                    # 请求响应数据
-                    json_data = self.fetch_page(cookies,page_index)
+        async with self.create_session(cookies) as session:
 
-                    # ⭐ 核心：统一失效判断
-                    if self.is_cookie_invalid(json_data):
-                        raise PermissionError("cookie 已失效或接口异常")
-                    # 成功直接跳出 retry
-                    break
-                except PermissionError as e:
-                    self.logger.warning(
-                        f"[{self.shop_name}] 第 {page_index} 页 cookie 失效，刷新中（{attempt}/{max_retry}）"
-                    )
-                    await self.cookie_manager.refresh()
-                    await asyncio.sleep(2)
+            async def on_auth_expired(error):
+                # scm 接口不用 _m_h5_tk，失效就是会话过期，直接重新登录
+                await self.cookie_manager.refresh()
+                cookies, _ = await self.cookie_manager.get_auth()
 
-                except Exception as e:
-                    self.logger.error(
-                        f"[{self.shop_name}] 第 {page_index} 页请求异常（{attempt}/{max_retry}）：{e}"
-                    )
-                    await asyncio.sleep(2)
+                # 更新 session cookie
+                session.cookie_jar.clear()
+                session.cookie_jar.update_cookies(cookies)
+
+            while True:
+                async def fetch():
+                    await self.rate_limiter.acquire(self.url)
+                    # 请求响应数据
+                    return await self.fetch_page(session, page_index)
 
+                try:
+                    # 只有登录失效才刷新 cookie，网络错误 / 限流只退避重试
+                    json_data = await call_with_retry(
+                        fetch, on_auth_expired, self.logger, f"[{self.shop_name}] 第 {page_index} 页"
+                    )
+                except CrawlError as e:
+                    # ---------- retry 全失败 ----------
+                    self.logger.error(f"[{self.shop_name}] 第 {page_index} 页多次失败，终止任务：{e}")
+                    return
 
-            # 解析数据
-            items=self.parse_page(json_data)
-            self.logger.info(f'解析得到{len(items)}条数据')
+                # 解析数据
+                items=self.parse_page(json_data)
+                self.logger.info(f'解析得到{len(items)}条数据')
 
-            # 保存数据
-            if items:
-                self.save_items(items)
-                self.logger.info(f'第{page_index}页，数据保存成功')
+                if items:
+                    yield page_index, items
 
-            if len(items)<50:
-                self.logger.info('已经达到最后一页了')
-                break
+                if len(items)<50:
+                    self.logger.info('已经达到最后一页了')
+                    self.completed = True
+                    break
 
-            page_index += 1
+                page_index += 1
 
-            await asyncio.sleep(0.8)
+    async def run(self):
+        checkpoint = CrawlCheckpoint(self.shop_name, "stock")
+        if checkpoint.done:
+            self.logger.info(f"[{self.shop_name}] 今天的库存数据已经抓完，跳过")
+            return
+
+        checkpoint.reconcile(self.output_file())
+        if checkpoint.last_page:
+            self.logger.info(f"[{self.shop_name}] 从第 {checkpoint.next_page} 页继续抓取")
+
+        async for page_index, items in self.iter_pages(start_page=checkpoint.next_page):
+            # 去重后保存数据，再记录进度（parquet 按页覆盖写，放在 csv 之前）
+            new_items = checkpoint.filter_new(items)
+            if new_items:
+                if "parquet" in self.formats:
+                    write_snapshot("stock", self.shop_name, page_index, new_items)
+                if "csv" in self.formats:
+                    self.save_items(new_items)
+            checkpoint.commit(page_index, new_items)
+            self.logger.info(f'第{page_index}页，{len(new_items)}条数据保存成功')
+
+        if self.completed:
+            checkpoint.finish()
 
 async def main():
     shop_name_list = ['SMT202', 'SMT214', 'SMT212', 'SMT204', 'SMT203', 'SMT201', 'SMT208']
@@ -6,9 +6,15 @@ import pandas as pd
 from datetime import datetime
 from pathlib import Path
 from utils.logger import get_logger
-import asyncio
 import time
+import argparse
 from utils.dingtalk_bot import ding_bot_send
+from utils.goods_catalog import GoodsCatalog
+from modules.sale_records import build_records_frame, RECORD_FIELDS
+from utils.snapshot_store import has_snapshot, read_snapshot
+from utils.auth_preflight import preflight_shops, DEFAULT_MAX_LOGINS
+from modules.sale_pipeline import SalePipeline
+from utils.browser_service import get_browser_service
 
 """跑smt销售数据"""
 
@@ -37,7 +43,7 @@ def upload_multiple_records(config,records):
 
     logger.info(f"准备上传 {len(records)} 条记录...")
 
-    # 批量上传，每批50条，批次间延迟0.2秒，失败时重试2次
+    # 批量上传，每批50条，批次间节奏由限速器控制，失败时重试2次
     results = uploader.upload_batch_records(records, batch_size=50, delay=0.2, max_retries=2)
 
     # 分析结果
@@ -82,17 +88,48 @@ def test_delete_records(config):
     return deleter
 
 
-def simple_match(shop_name):
+def load_stock_ids(shop_name):
+    """
+    读取当天库存数据里的全部货号ID（有 parquet 快照时优先读快照）
+    """
+    if has_snapshot("stock", shop_name):
+        df = read_snapshot("stock", shop_name, columns=['货号ID'])
+        return set(df['货号ID'])
+
+    current_date = datetime.now().strftime("%Y%m%d")
+    out_dir = Path(__file__).resolve().parent / "data" / "sale"
+    df = pd.read_csv(f'{out_dir}/{shop_name}_stock_{current_date}.csv', usecols=['货号ID'])
+    return set(df['货号ID'].astype(str))
+
+
+def simple_match(shop_name, sku_map=None):
+    """
+    sku_map: 货号ID → sku（来自商品目录）；不传时读取当天的商品数据
+
+    当天有 parquet 快照时只读需要的列，否则读 csv
+    """
     current_date = datetime.now().strftime("%Y%m%d")
 
     # 读取文件
     out_dir = Path(__file__).resolve().parent / "data" / "sale"
-    sku_df = pd.read_csv(f'{out_dir}/{shop_name}_goods_{current_date}.csv')  # 货号ID,sku
-    main_df = pd.read_csv(f'{out_dir}/{shop_name}_stock_{current_date}.csv')  # 平台,店铺,货号ID,商品名称,...
+    if sku_map is not None:
+        sku_df = pd.DataFrame(list(sku_map.items()), columns=['货号ID', 'sku'])
+    elif has_snapshot("goods", shop_name):
+        sku_df = read_snapshot("goods", shop_name, columns=['货号ID', 'sku'])
+    else:
+        sku_df = pd.read_csv(f'{out_dir}/{shop_name}_goods_{current_date}.csv')  # 货号ID,sku
+
+    if has_snapshot("stock", shop_name):
+        main_df = read_snapshot("stock", shop_name, columns=['货号ID'] + RECORD_FIELDS)
+    else:
+        main_df = pd.read_csv(f'{out_dir}/{shop_name}_stock_{current_date}.csv')  # 平台,店铺,货号ID,商品名称,...
 
     sku_df['货号ID'] = sku_df['货号ID'].astype(str)
     main_df['货号ID'] = main_df['货号ID'].astype(str)
 
+    # 同一个货号ID只保留一条，避免 left merge 把行数放大
+    sku_df = sku_df.drop_duplicates('货号ID')
+
     # 使用merge合并数据
     result_df = pd.merge(
         main_df,
@@ -103,39 +140,102 @@ def simple_match(shop_name):
 
     result_df.to_csv(f'{shop_name}-合并结果.csv', index=False, encoding='utf-8-sig')
 
-    records=[]
-    # 修复：解包 iterrows() 返回的元组
-    for index, row in result_df.iterrows():
-        # 检查指定字段是否都为0
-        if (row['今日销量'] == 0 and
-                row['近7天销量'] == 0 and
-                row['近30天销量'] == 0 and
-                row['平台库存'] == 0 and
-                row['在途库存'] == 0):
-            continue  # 跳过这条记录
-
-        record = {
-            "商品名称": row['商品名称'],
-            "抓取数据日期": row['抓取数据日期'],
-            "今日销量": row['今日销量'],
-            "近7天销量": row['近7天销量'],
-            "近30天销量": row['近30天销量'],
-            "平台库存": row['平台库存'],
-            "平台": row['平台'],
-            "在途库存": row['在途库存'],
-            "sku": str(row['sku']) if not pd.isna(row['sku']) else "",
-            "店铺": row['店铺'],
-        }
-        records.append(record)
+    records = build_records_frame(result_df)
 
     return records
 
 
-async def main():
+async def run_shop(shop_name, config, use_catalog=True, stream=False, write_csv=False, formats=("csv",)):
+    """
+    单个店铺的完整流程：库存 → 商品（目录增量）→ 匹配 → 上传
+
+    use_catalog=False 时按老流程每天全量抓商品 csv
+    stream=True 时边抓库存边上传，不经过 csv（write_csv 控制是否旁路写 csv）
+    formats: 非流式时爬虫的落盘格式（csv / parquet）
+    """
+    if stream:
+        logger.info(f'---------------------------------{shop_name}流式抓取并上传-----------------------------------')
+        pipeline = SalePipeline(shop_name, config, write_csv=write_csv)
+        count = await pipeline.run()
+        logger.info(f'{shop_name}数据上传成功')
+        return count
+
+    if not use_catalog:
+        logger.info(f'---------------------------------开始爬取店铺--{shop_name}--商品数据-----------------------------------')
+        spider_goods = SMTGoodsSpider(shop_name, formats=formats)
+        await spider_goods.run()
+
+    logger.info(
+        f'---------------------------------开始爬取店铺--{shop_name}--库存数据-----------------------------------')
+    spider_socket = SMTStockSpider(shop_name, formats=formats)
+    await spider_socket.run()
+
+    sku_map = None
+    if use_catalog:
+        logger.info(f'---------------------------------{shop_name}同步商品目录-----------------------------------')
+        stock_ids = await asyncio.to_thread(load_stock_ids, shop_name)
+        catalog = GoodsCatalog(shop_name)
+        await catalog.sync(wanted_ids=stock_ids)
+        sku_map = catalog.skus
+
+    logger.info(f'---------------------------------{shop_name}开始匹配sku数据-----------------------------------')
+    # pandas 与钉钉上传都是同步阻塞的，放到线程里，避免卡住其他店铺
+    records = await asyncio.to_thread(simple_match, shop_name, sku_map)
+
+    logger.info(f'---------------------------------{shop_name}开始上传数据-----------------------------------')
+    await asyncio.to_thread(upload_multiple_records, config, records)
+
+    logger.info(f'{shop_name}数据上传成功')
+    return len(records)
+
+
+async def run_shops(shop_name_list, config, max_shops=4, **shop_options):
+    """
+    多店铺并发执行，最多同时跑 max_shops 个店铺
+
+    Returns:
+        每个店铺的执行结果列表（顺序与 shop_name_list 一致）
+    """
+    semaphore = asyncio.Semaphore(max(1, max_shops))
+
+    async def _run(shop_name):
+        async with semaphore:
+            start = time.perf_counter()
+            try:
+                count = await run_shop(shop_name, config, **shop_options)
+                return {
+                    "shop": shop_name,
+                    "success": True,
+                    "records": count,
+                    "cost": time.perf_counter() - start,
+                }
+            except Exception as e:
+                logger.error(f'{shop_name} 执行失败: {e}', exc_info=True)
+                return {
+                    "shop": shop_name,
+                    "success": False,
+                    "error": str(e),
+                    "cost": time.perf_counter() - start,
+                }
+
+    return await asyncio.gather(*(_run(name) for name in shop_name_list))
+
+
+def format_shop_results(results, total_cost):
+    lines = []
+    for r in results:
+        if r["success"]:
+            lines.append(f'{r["shop"]}: 成功，{r["records"]} 条，耗时 {format_seconds(r["cost"])}')
+        else:
+            lines.append(f'{r["shop"]}: 失败（{r["error"]}），耗时 {format_seconds(r["cost"])}')
+    lines.append(f'总耗时：{format_seconds(total_cost)}')
+    return "\n".join(lines)
+
+
+async def main(max_shops=4, max_logins=DEFAULT_MAX_LOGINS, **shop_options):
     total_start = time.perf_counter()
 
-    logger = get_logger(name='smt_sale_main')
-    logger.info('程序开始启动')
+    logger.info(f'程序开始启动，最多同时运行 {max_shops} 个店铺')
 
     config = {
         "base_id": "XPwkYGxZV3KRy1Gxfyb1E305VAgozOKL", # 文档ID
@@ -145,32 +245,52 @@ async def main():
 
     shop_name_list = ['SMT202', 'SMT214', 'SMT212', 'SMT204', 'SMT203', 'SMT201', 'SMT208']
     # shop_name_list=['SMT208']
-    for shop_name in shop_name_list:
-        logger.info(f'---------------------------------开始爬取店铺--{shop_name}--商品数据-----------------------------------')
-        spider_goods = SMTGoodsSpider(shop_name)
-        await spider_goods.run()
 
-        logger.info(
-            f'---------------------------------开始爬取店铺--{shop_name}--库存数据-----------------------------------')
-        spider_socket = SMTStockSpider(shop_name)
-        await spider_socket.run()
+    # 先并发检查 cookie，过期的集中登录，抓取过程中就不会再被登录打断
+    try:
+        auth_status = await preflight_shops(shop_name_list, max_logins=max_logins)
+        ready_shops = [name for name in shop_name_list if auth_status[name] != "failed"]
 
-        await asyncio.sleep(1)
-        logger.info('---------------------------------开始匹配sku数据-----------------------------------')
-        records=simple_match(shop_name)
+        results = await run_shops(ready_shops, config, max_shops=max_shops, **shop_options)
+    finally:
+        # 登录用过的云浏览器连接统一在这里关闭
+        await get_browser_service().close()
+    results += [
+        {"shop": name, "success": False, "error": "预检登录失败", "cost": 0}
+        for name in shop_name_list if auth_status[name] == "failed"
+    ]
 
-        logger.info('---------------------------------开始上传数据-----------------------------------')
-        upload_multiple_records(config, records)
-
-        logger.info(f'{shop_name}数据上传成功')
+    total_cost = time.perf_counter() - total_start
+    summary = format_shop_results(results, total_cost)
+    logger.info(f"店铺执行结果:\n{summary}")
 
-    ding_bot_send('me', 'SMT的销售任务完成')
+    failed = [r["shop"] for r in results if not r["success"]]
+    if failed:
+        ding_bot_send('me', f'SMT的销售任务完成，失败店铺: {",".join(failed)}\n{summary}')
+    else:
+        ding_bot_send('me', f'SMT的销售任务完成\n{summary}')
 
-    total_cost = time.perf_counter() - total_start
     logger.info(f"🎯 全流程完成，总耗时：{format_seconds(total_cost)}")
 
 
+def parse_args():
+    parser = argparse.ArgumentParser(description="跑smt销售数据")
+    parser.add_argument("--max-shops", type=int, default=4, help="最多同时运行的店铺数")
+    parser.add_argument("--max-logins", type=int, default=DEFAULT_MAX_LOGINS, help="预检时最多同时登录的店铺数")
+    parser.add_argument("--no-catalog", action="store_true", help="不用商品目录，每天全量抓商品")
+    parser.add_argument("--stream", action="store_true", help="边抓库存边上传，不经过 csv")
+    parser.add_argument("--csv", action="store_true", help="流式模式下同时写库存 csv")
+    parser.add_argument("--formats", default="csv", help="落盘格式，逗号分隔：csv,parquet")
+    return parser.parse_args()
 
 
 if __name__ == "__main__":
-    asyncio.run(main())
+    args = parse_args()
+    asyncio.run(main(
+        max_shops=args.max_shops,
+        max_logins=args.max_logins,
+        use_catalog=not args.no_catalog,
+        stream=args.stream,
+        write_csv=args.csv,
+        formats=tuple(args.formats.split(",")),
+    ))
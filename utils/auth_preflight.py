@@ -0,0 +1,49 @@
+import asyncio
+from typing import Dict, List
+
+from utils.cookie_manager import CookieManager
+from utils.logger import get_logger
+
+"""任务开始前并发检查所有店铺的 cookie，过期的集中并发登录，之后再开始抓取"""
+
+logger = get_logger("auth_preflight")
+
+# 本地云浏览器 API（50213 端口）同时能承受的登录数
+DEFAULT_MAX_LOGINS = 3
+
+
+async def preflight_shops(shop_names: List[str], max_logins: int = DEFAULT_MAX_LOGINS) -> Dict[str, str]:
+    """
+    Returns:
+        shop -> "valid"（cookie 可用）/ "refreshed"（重新登录成功）/ "failed"（登录失败）
+    """
+    managers = {name: CookieManager(name) for name in shop_names}
+
+    async def check(name):
+        auth = managers[name].load_auth()
+        if not auth:
+            return False
+        return await managers[name].check_cookie_valid(auth[0])
+
+    checks = await asyncio.gather(*(check(name) for name in shop_names))
+    status = {name: "valid" for name, ok in zip(shop_names, checks) if ok}
+    expired = [name for name, ok in zip(shop_names, checks) if not ok]
+
+    logger.info(f"cookie 预检：有效 {len(status)} 个，需要登录 {len(expired)} 个 {expired}")
+
+    semaphore = asyncio.Semaphore(max(1, max_logins))
+
+    async def login(name):
+        async with semaphore:
+            try:
+                await managers[name].refresh(force=True)
+                logger.info(f"[{name}] 预检登录成功")
+                return "refreshed"
+            except Exception as e:
+                logger.error(f"[{name}] 预检登录失败: {e}")
+                return "failed"
+
+    results = await asyncio.gather(*(login(name) for name in expired))
+    status.update(zip(expired, results))
+
+    return {name: status[name] for name in shop_names}
@@ -0,0 +1,171 @@
+import asyncio
+from contextlib import asynccontextmanager
+from typing import Dict, Optional
+
+import aiohttp
+from playwright.async_api import async_playwright
+
+from utils.logger import get_logger
+
+"""进程内共享的浏览器服务
+
+- 整个进程只启动一个 Playwright driver
+- 按 cloud_account_id 缓存云浏览器的 CDP 连接，用完后空闲 idle_ttl 秒才断开并关闭云浏览器
+- 登录、财务导出都从这里拿 context，同一账号多次使用只付一次冷启动
+"""
+
+CLOUD_BROWSER_API = "http://localhost:50213/api/v2/browser"
+
+# 连接空闲多少秒后关闭
+DEFAULT_IDLE_TTL = 120
+
+
+class BrowserService:
+    def __init__(self, idle_ttl: float = DEFAULT_IDLE_TTL):
+        self.idle_ttl = idle_ttl
+        self.logger = get_logger("browser_service")
+        self._reset()
+
+    def _reset(self):
+        self._loop = None
+        self._playwright = None
+        self._driver_lock: Optional[asyncio.Lock] = None
+        self._browsers = {}
+        self._leases: Dict[str, int] = {}
+        self._idle_handles: Dict[str, asyncio.TimerHandle] = {}
+        self._account_locks: Dict[str, asyncio.Lock] = {}
+
+    def _bind_loop(self):
+        """
+        Playwright 对象绑定在事件循环上，换了循环（再次 asyncio.run）就重新开始
+        """
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            self._reset()
+            self._loop = loop
+            self._driver_lock = asyncio.Lock()
+
+    # ---------- 云浏览器 API ----------
+    async def start_cloud_browser(self, account_id: str) -> str:
+        async with aiohttp.ClientSession() as session:
+            async with session.get(
+                f"{CLOUD_BROWSER_API}/start",
+                params={"account_id": account_id},
+                timeout=aiohttp.ClientTimeout(total=10),
+            ) as resp:
+                resp.raise_for_status()
+                data = await resp.json(content_type=None)
+        return data["data"]["ws"]["puppeteer"]
+
+    async def stop_cloud_browser(self, account_id: str):
+        """
+        通过云浏览器 API 关闭浏览器实例
+        """
+        try:
+            async with aiohttp.ClientSession() as session:
+                async with session.get(
+                    f"{CLOUD_BROWSER_API}/stop",
+                    params={"account_id": account_id},
+                    timeout=aiohttp.ClientTimeout(total=10),
+                ) as resp:
+                    resp.raise_for_status()
+            self.logger.info(f"[{account_id}] 云浏览器已关闭")
+        except Exception as e:
+            self.logger.error(f"[{account_id}] 关闭云浏览器失败: {e}")
+
+    # ---------- driver / 连接 ----------
+    async def _ensure_driver(self):
+        async with self._driver_lock:
+            if self._playwright is None:
+                self._playwright = await async_playwright().start()
+        return self._playwright
+
+    async def acquire(self, account_id: str):
+        """
+        拿到该账号云浏览器的默认 context；用完必须 release
+        """
+        self._bind_loop()
+        lock = self._account_locks.setdefault(account_id, asyncio.Lock())
+
+        async with lock:
+            handle = self._idle_handles.pop(account_id, None)
+            if handle:
+                handle.cancel()
+
+            browser = self._browsers.get(account_id)
+            if browser is None or not browser.is_connected():
+                playwright = await self._ensure_driver()
+                ws_endpoint = await self.start_cloud_browser(account_id)
+                browser = await playwright.chromium.connect_over_cdp(ws_endpoint)
+                self._browsers[account_id] = browser
+                self.logger.info(f"[{account_id}] 已连接云浏览器")
+
+            self._leases[account_id] = self._leases.get(account_id, 0) + 1
+            return browser.contexts[0]
+
+    def release(self, account_id: str):
+        """
+        归还连接；没人使用后 idle_ttl 秒再关闭
+        """
+        self._leases[account_id] = max(0, self._leases.get(account_id, 0) - 1)
+        if self._leases[account_id] or account_id not in self._browsers:
+            return
+
+        self._idle_handles[account_id] = self._loop.call_later(
+            self.idle_ttl,
+            lambda: asyncio.ensure_future(self._close_if_idle(account_id)),
+        )
+
+    async def _close_if_idle(self, account_id: str):
+        async with self._account_locks[account_id]:
+            if self._leases.get(account_id):
+                return
+            await self.discard(account_id)
+
+    async def discard(self, account_id: str):
+        """
+        立即断开并关闭云浏览器（出错后调用，下次使用会重新启动）
+        """
+        handle = self._idle_handles.pop(account_id, None)
+        if handle:
+            handle.cancel()
+
+        browser = self._browsers.pop(account_id, None)
+        if browser is not None:
+            try:
+                await browser.close()
+            except Exception as e:
+                self.logger.warning(f"[{account_id}] 断开 CDP 连接失败: {e}")
+        await self.stop_cloud_browser(account_id)
+
+    @asynccontextmanager
+    async def context(self, account_id: str):
+        context = await self.acquire(account_id)
+        try:
+            yield context
+        finally:
+            self.release(account_id)
+
+    async def close(self):
+        """
+        任务结束时调用：关闭所有连接、云浏览器和 driver
+        """
+        if self._loop is None:
+            return
+
+        for account_id in list(self._browsers):
+            await self.discard(account_id)
+
+        if self._playwright is not None:
+            await self._playwright.stop()
+        self._reset()
+
+
+_browser_service: Optional[BrowserService] = None
+
+
+def get_browser_service() -> BrowserService:
+    global _browser_service
+    if _browser_service is None:
+        _browser_service = BrowserService()
+    return _browser_service
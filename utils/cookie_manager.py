@@ -1,25 +1,39 @@
 import json
 import time
 import hashlib
+import asyncio
 import aiohttp
-from pathlib import Path
-from typing import Dict, Optional
+from typing import Dict, Optional, Tuple
 
 from utils.config_loader import get_shop_config
+from utils.cookie_store import get_cookie_store
+from utils.crawl_errors import (
+    CrawlError, AuthExpiredError, TokenExpiredError, MTOP_TOKEN_COOKIES,
+    check_http_status, check_mtop_result,
+)
+from utils.logger import get_logger
 from modules.login import SimpleLogin
 
 
-COOKIE_DIR = Path(__file__).resolve().parent.parent / "data" / "cookies"
-
 
 class CookieManager:
+    # 同一店铺正在进行的登录（所有实例共享）：shop -> Future
+    _inflight: Dict[str, asyncio.Future] = {}
+    # 同一店铺最近一次登录完成的时间（monotonic）
+    _refreshed_at: Dict[str, float] = {}
+    # 刚登录完这么多秒内再来刷新的，直接复用新 cookie
+    REFRESH_REUSE_SECONDS = 30
+    # 进程内 cookie/token 缓存（同店铺的商品、库存爬虫共享）：shop -> (库里的 version, cookies, token)
+    _auth_cache: Dict[str, Tuple[int, Dict[str, str], str]] = {}
+
     def __init__(self, shop_name: str):
         self.shop_name = shop_name
-        self.cookie_file = COOKIE_DIR / f"{shop_name}.json"
+        self.store = get_cookie_store()
 
         cfg = get_shop_config(shop_name)
         self.channel_id = cfg["channelId"]
         self.cloud_account_id = cfg["cloud_account_id"]
+        self.logger = get_logger("cookie_manager")
 
         self.check_url = (
             "https://seller-acs.aliexpress.com/"
@@ -28,17 +42,114 @@ class CookieManager:
 
     # ---------- cookie ----------
     def load_cookies(self) -> Optional[Dict[str, str]]:
-        if not self.cookie_file.exists():
-            return None
-        data = json.loads(self.cookie_file.read_text(encoding="utf-8"))
-        return data.get("cookies_dict")
+        row = self.store.get(self.shop_name)
+        return row[0] if row else None
 
     def extract_token(self, cookies: Dict[str, str]) -> str:
         tk = cookies.get("_m_h5_tk", "")
         return tk.split("_")[0] if "_" in tk else ""
 
+    def load_auth(self) -> Optional[Tuple[Dict[str, str], str]]:
+        """
+        带缓存的 (cookies, token)；库里的 version 变了（本进程或其他进程写过）才重新读取解析
+        """
+        version = self.store.version(self.shop_name)
+        if version is None:
+            return None
+
+        cached = self._auth_cache.get(self.shop_name)
+        if cached and cached[0] == version:
+            return cached[1], cached[2]
+
+        row = self.store.get(self.shop_name)
+        if not row or not row[0]:
+            return None
+        cookies, version = row
+
+        token = self.extract_token(cookies)
+        self._auth_cache[self.shop_name] = (version, cookies, token)
+        return cookies, token
+
+    def invalidate(self):
+        self._auth_cache.pop(self.shop_name, None)
+
+    def update_cookies(self, updates: Dict[str, str]):
+        """
+        把新下发的 cookie 合并进 cookie 库（原子更新）
+        """
+        self.store.update(self.shop_name, updates)
+        self.invalidate()
+
     # ---------- 校验 ----------
+    async def _check_session(self, cookies: Dict[str, str]):
+        """
+        签名请求一次商品接口（pageSize=1），按 mtop 的 ret 分类抛出异常；正常时什么都不返回
+
+        mtop 登录失效也是 HTTP 200，只看状态码判断不出来
+        """
+        ts = int(time.time() * 1000)
+        app_key = "30267743"
+        data_str = json.dumps(
+            {"pageIndex": 1, "pageSize": 1, "channelId": str(self.channel_id)},
+            separators=(",", ":"),
+        )
+        sign = hashlib.md5(f"{self.extract_token(cookies)}&{ts}&{app_key}&{data_str}".encode()).hexdigest()
+        params = {
+            "jsv": "2.7.2",
+            "appKey": app_key,
+            "t": str(ts),
+            "sign": sign,
+            "v": "1.0",
+            "api": "mtop.ae.scitem.read.pagequery",
+            "type": "originaljson",
+            "data": data_str,
+        }
+
+        async with aiohttp.ClientSession(cookies=cookies) as session:
+            async with session.get(
+                self.check_url,
+                params=params,
+                allow_redirects=False,
+                timeout=aiohttp.ClientTimeout(total=10),
+            ) as resp:
+                check_http_status(resp.status)
+                result = await resp.json(content_type=None)
+                set_cookies = {name: morsel.value for name, morsel in resp.cookies.items()}
+
+        check_mtop_result(result, set_cookies)
+
     async def check_cookie_valid(self, cookies: Dict[str, str]) -> bool:
+        """
+        会话还有效就返回 True；只是 _m_h5_tk 过期时就地 HTTP 续期后再查一次
+
+        网络错误、限流等判断不了的情况按有效处理，交给抓取时的重试
+        """
+        for _ in range(2):
+            try:
+                await self._check_session(cookies)
+            except TokenExpiredError as e:
+                if not await self.renew_token(e.fresh_cookies):
+                    return False
+                cookies = self.load_auth()[0]
+                continue
+            except AuthExpiredError as e:
+                self.logger.info(f"[{self.shop_name}] 会话已失效: {e}")
+                return False
+            except (CrawlError, aiohttp.ClientError, asyncio.TimeoutError, ValueError) as e:
+                self.logger.warning(f"[{self.shop_name}] cookie 校验请求失败，暂按有效处理: {e}")
+                return True
+
+            self.store.mark_validated(self.shop_name)
+            return True
+
+        # 续期后 token 仍然无效
+        return False
+
+    # ---------- token 续期 ----------
+    async def fetch_fresh_token(self, cookies: Dict[str, str]) -> Dict[str, str]:
+        """
+        不带签名请求一次 mtop 接口，服务端会在 Set-Cookie 里下发新的 _m_h5_tk
+        """
         try:
             async with aiohttp.ClientSession(cookies=cookies) as session:
                 async with session.get(
@@ -46,28 +157,104 @@ class CookieManager:
                     allow_redirects=False,
                     timeout=aiohttp.ClientTimeout(total=10),
                 ) as resp:
-                    return resp.status == 200
-        except Exception:
+                    return {
+                        name: morsel.value
+                        for name, morsel in resp.cookies.items()
+                        if name in MTOP_TOKEN_COOKIES and morsel.value
+                    }
+        except Exception as e:
+            self.logger.warning(f"[{self.shop_name}] 获取新 token 失败: {e}")
+            return {}
+
+    async def renew_token(self, fresh_cookies: Optional[Dict[str, str]] = None) -> bool:
+        """
+        只续期 _m_h5_tk，不开浏览器
+
+        fresh_cookies: 失败响应 Set-Cookie 里带的新 token；没有时自己请求一次
+        Returns:
+            是否拿到了可用的新 token
+        """
+        auth = self.load_auth()
+        if not auth:
+            return False
+        cookies, _ = auth
+
+        fresh = dict(fresh_cookies or {})
+        if not fresh.get("_m_h5_tk"):
+            fresh = await self.fetch_fresh_token(cookies)
+        if not fresh.get("_m_h5_tk"):
             return False
 
+        # 并发的请求拿到的是同一个新 token，第一个写入后其他的直接复用
+        if cookies.get("_m_h5_tk") != fresh["_m_h5_tk"]:
+            self.update_cookies(fresh)
+            self.logger.info(f"[{self.shop_name}] _m_h5_tk 已通过 HTTP 续期")
+        return True
+
+    async def handle_auth_expired(self, error=None):
+        """
+        call_with_retry 的 on_auth_expired：token 过期先 HTTP 续期，续期不了或会话失效才浏览器登录
+        """
+        if isinstance(error, TokenExpiredError) and await self.renew_token(error.fresh_cookies):
+            return
+        await self.refresh()
+
     # ---------- 刷新 ----------
-    async def refresh(self):
-        login = SimpleLogin(
-            shop_name=self.shop_name)
+    async def refresh(self, force: bool = False):
+        """
+        单飞登录：同一店铺同时只有一个浏览器登录
+
+        - 有登录正在进行：等待它的结果（成功/失败都共享）
+        - 刚登录完（REFRESH_REUSE_SECONDS 内）：直接复用，除非 force=True
+        """
+        inflight = self._inflight.get(self.shop_name)
+        if inflight is not None:
+            await asyncio.shield(inflight)
+            return
+
+        refreshed_at = self._refreshed_at.get(self.shop_name)
+        if not force and refreshed_at and time.monotonic() - refreshed_at < self.REFRESH_REUSE_SECONDS:
+            return
+
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[self.shop_name] = future
+        try:
+            login = SimpleLogin(
+                shop_name=self.shop_name)
+
+            ok = await login.login_and_save_cookies()
+            if not ok:
+                raise RuntimeError(f"[{self.shop_name}] 登录失败")
 
-        ok = await login.login_and_save_cookies()
-        if not ok:
-            raise RuntimeError(f"[{self.shop_name}] 登录失败")
+            self.invalidate()
+            self._refreshed_at[self.shop_name] = time.monotonic()
+            future.set_result(True)
+        except BaseException as e:
+            if isinstance(e, asyncio.CancelledError):
+                future.cancel()
+            else:
+                future.set_exception(e)
+                # 没有等待者时避免 "exception was never retrieved" 警告
+                future.exception()
+            raise
+        finally:
+            self._inflight.pop(self.shop_name, None)
 
     # ---------- 对外统一 ----------
     async def get_auth(self):
-        cookies = self.load_cookies()
+        """
+        返回 (cookies, token)，命中缓存时只是一次字典查找；调用方不要修改返回的 cookies
+        """
+        auth = self.load_auth()
 
-        if not cookies:
+        if not auth:
             await self.refresh()
-            cookies = self.load_cookies()
+            auth = self.load_auth()
 
-        token = self.extract_token(cookies)
+        if not auth:
+            raise RuntimeError(f"[{self.shop_name}] cookie 加载失败")
+
+        cookies, token = auth
         if not token:
             raise RuntimeError("token 解析失败")
 
@@ -0,0 +1,173 @@
+import json
+import sqlite3
+import threading
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, Optional, Tuple
+
+"""所有店铺的 cookie 存在一个 SQLite（WAL）库里，多进程同时读写也不会读到半个文件
+
+data/cookies/cookies.db，每个店铺一行；老的 data/cookies/{店铺}.json 第一次打开时自动导入
+"""
+
+COOKIE_DIR = Path(__file__).resolve().parent.parent / "data" / "cookies"
+COOKIE_DB = COOKIE_DIR / "cookies.db"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS cookies (
+    shop_name      TEXT PRIMARY KEY,
+    cookies_json   TEXT NOT NULL,
+    version        INTEGER NOT NULL DEFAULT 1,
+    created_at     TEXT NOT NULL,
+    updated_at     TEXT NOT NULL,
+    last_validated TEXT
+)
+"""
+
+
+def _now() -> str:
+    return datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+
+
+class CookieStore:
+    def __init__(self, db_path: Path = COOKIE_DB):
+        self.db_path = Path(db_path)
+        # sqlite 连接不能跨线程用，每个线程一个
+        self._local = threading.local()
+
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        with self._connect() as conn:
+            conn.execute(SCHEMA)
+        self.migrate_json(self.db_path.parent)
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=10)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("PRAGMA busy_timeout=10000")
+            self._local.conn = conn
+        return conn
+
+    # ---------- 读 ----------
+    def get(self, shop_name: str) -> Optional[Tuple[Dict[str, str], int]]:
+        """
+        Returns:
+            (cookies, version)；没有记录时返回 None
+        """
+        row = self._connect().execute(
+            "SELECT cookies_json, version FROM cookies WHERE shop_name = ?", (shop_name,)
+        ).fetchone()
+        if row is None:
+            return None
+        return json.loads(row[0]), row[1]
+
+    def version(self, shop_name: str) -> Optional[int]:
+        """
+        每次写入 version 加一，用来判断进程内缓存是否过期（只查一个整数）
+        """
+        row = self._connect().execute(
+            "SELECT version FROM cookies WHERE shop_name = ?", (shop_name,)
+        ).fetchone()
+        return row[0] if row else None
+
+    def info(self, shop_name: str) -> Optional[dict]:
+        row = self._connect().execute(
+            "SELECT created_at, updated_at, last_validated, version FROM cookies WHERE shop_name = ?",
+            (shop_name,),
+        ).fetchone()
+        if row is None:
+            return None
+        return dict(zip(("created_at", "updated_at", "last_validated", "version"), row))
+
+    # ---------- 写 ----------
+    def save(self, shop_name: str, cookies: Dict[str, str], created_at: Optional[str] = None):
+        """
+        登录后整体替换该店铺的 cookie（单条 UPSERT，原子）
+        """
+        now = _now()
+        with self._connect() as conn:
+            conn.execute(
+                """
+                INSERT INTO cookies (shop_name, cookies_json, version, created_at, updated_at, last_validated)
+                VALUES (?, ?, 1, ?, ?, ?)
+                ON CONFLICT(shop_name) DO UPDATE SET
+                    cookies_json = excluded.cookies_json,
+                    version = cookies.version + 1,
+                    created_at = excluded.created_at,
+                    updated_at = excluded.updated_at,
+                    last_validated = excluded.last_validated
+                """,
+                (shop_name, json.dumps(cookies, ensure_ascii=False), created_at or now, now, now),
+            )
+
+    def update(self, shop_name: str, updates: Dict[str, str]) -> bool:
+        """
+        合并部分 cookie（例如续期的 _m_h5_tk），读-改-写在同一个写事务里
+
+        Returns:
+            该店铺没有记录时返回 False
+        """
+        conn = self._connect()
+        with conn:
+            # 先拿写锁，避免两个进程同时合并时互相覆盖
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute(
+                "SELECT cookies_json FROM cookies WHERE shop_name = ?", (shop_name,)
+            ).fetchone()
+            if row is None:
+                return False
+
+            cookies = json.loads(row[0])
+            cookies.update(updates)
+            conn.execute(
+                "UPDATE cookies SET cookies_json = ?, version = version + 1, updated_at = ? WHERE shop_name = ?",
+                (json.dumps(cookies, ensure_ascii=False), _now(), shop_name),
+            )
+        return True
+
+    def mark_validated(self, shop_name: str):
+        # 不改 version，不会让其他进程的缓存失效
+        with self._connect() as conn:
+            conn.execute(
+                "UPDATE cookies SET last_validated = ? WHERE shop_name = ?", (_now(), shop_name)
+            )
+
+    # ---------- 迁移 ----------
+    def migrate_json(self, json_dir: Path):
+        """
+        导入老的 {店铺}.json；库里已有的店铺不覆盖，json 文件保留不动
+        """
+        for path in sorted(Path(json_dir).glob("*.json")):
+            try:
+                data = json.loads(path.read_text(encoding="utf-8"))
+            except (OSError, ValueError):
+                continue
+
+            cookies = data.get("cookies_dict")
+            shop_name = data.get("shop_name") or path.stem
+            if not cookies:
+                continue
+
+            now = _now()
+            with self._connect() as conn:
+                conn.execute(
+                    """
+                    INSERT OR IGNORE INTO cookies (shop_name, cookies_json, version, created_at, updated_at)
+                    VALUES (?, ?, 1, ?, ?)
+                    """,
+                    (shop_name, json.dumps(cookies, ensure_ascii=False), data.get("created_at") or now, now),
+                )
+
+
+_cookie_store: Optional[CookieStore] = None
+_cookie_store_lock = threading.Lock()
+
+
+def get_cookie_store() -> CookieStore:
+    global _cookie_store
+    with _cookie_store_lock:
+        if _cookie_store is None:
+            _cookie_store = CookieStore()
+    return _cookie_store
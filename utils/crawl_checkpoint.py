@@ -0,0 +1,101 @@
+import csv
+import json
+from datetime import datetime
+from pathlib import Path
+from typing import Iterable, List, Optional
+
+"""按 店铺 + 类型 + 日期 记录抓取进度，重跑时从上次成功的页之后继续，已写过的货号ID不再重复写"""
+
+CHECKPOINT_DIR = Path(__file__).resolve().parent.parent / "data" / "checkpoints"
+
+
+class CrawlCheckpoint:
+    def __init__(self, shop_name: str, kind: str, date_str: Optional[str] = None):
+        """
+        Args:
+            shop_name: 店铺名
+            kind: goods / stock
+            date_str: YYYYMMDD，默认今天
+        """
+        self.shop_name = shop_name
+        self.kind = kind
+        self.date_str = date_str or datetime.now().strftime("%Y%m%d")
+        self.checkpoint_file = CHECKPOINT_DIR / self.date_str / f"{shop_name}_{kind}.json"
+
+        self.last_page = 0
+        self.done = False
+        self.seen_ids = set()
+
+        self.load()
+
+    # ---------- 读写 ----------
+    def load(self):
+        if not self.checkpoint_file.exists():
+            return
+
+        data = json.loads(self.checkpoint_file.read_text(encoding="utf-8"))
+        self.last_page = data.get("last_page", 0)
+        self.done = data.get("done", False)
+        self.seen_ids = set(data.get("seen_ids", []))
+
+    def save(self):
+        self.checkpoint_file.parent.mkdir(parents=True, exist_ok=True)
+
+        data = {
+            "shop_name": self.shop_name,
+            "kind": self.kind,
+            "date": self.date_str,
+            "last_page": self.last_page,
+            "done": self.done,
+            "updated_at": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+            "seen_ids": sorted(self.seen_ids),
+        }
+
+        # 先写临时文件再替换，崩溃时不会留下半个文件
+        tmp_file = self.checkpoint_file.with_suffix(".json.tmp")
+        tmp_file.write_text(json.dumps(data, ensure_ascii=False), encoding="utf-8")
+        tmp_file.replace(self.checkpoint_file)
+
+    def reconcile(self, csv_file: Path):
+        """
+        以已经写入 csv 的货号ID为准补齐 seen_ids
+        （写完 csv、还没来得及记进度就崩溃的那一页，重跑时不会重复写）
+        """
+        if not csv_file.exists():
+            return
+
+        with open(csv_file, newline="", encoding="utf-8-sig") as f:
+            for row in csv.DictReader(f):
+                if row.get("货号ID"):
+                    self.seen_ids.add(row["货号ID"])
+
+    # ---------- 进度 ----------
+    @property
+    def next_page(self) -> int:
+        return self.last_page + 1
+
+    def filter_new(self, items: List[dict]) -> List[dict]:
+        """
+        去掉已经写过的货号ID（同一页内重复的也只保留一条）
+        """
+        new_items = []
+        ids = set()
+        for item in items:
+            key = str(item["货号ID"])
+            if key in self.seen_ids or key in ids:
+                continue
+            ids.add(key)
+            new_items.append(item)
+        return new_items
+
+    def commit(self, page: int, items: Iterable[dict]):
+        """
+        页面数据落盘之后调用
+        """
+        self.seen_ids.update(str(i["货号ID"]) for i in items)
+        self.last_page = max(self.last_page, page)
+        self.save()
+
+    def finish(self):
+        self.done = True
+        self.save()
@@ -0,0 +1,167 @@
+import asyncio
+from typing import Awaitable, Callable, Optional
+
+"""mtop / scm 接口的错误分类，以及按类别区分的重试策略
+
+只有 AuthExpiredError 才会触发 cookie 刷新：TokenExpiredError（_m_h5_tk 过期）走 HTTP 续期，
+会话真正失效才走浏览器登录；网络错误、限流、返回格式异常都只按各自的策略退避重试
+"""
+
+
+class CrawlError(Exception):
+    """抓取错误基类"""
+
+
+class TransportError(CrawlError):
+    """网络层错误：超时、连接失败、5xx 等"""
+
+
+class ThrottledError(CrawlError):
+    """被限流 / 风控"""
+
+
+class AuthExpiredError(CrawlError):
+    """登录态或 token 失效"""
+
+
+class TokenExpiredError(AuthExpiredError):
+    """只是 _m_h5_tk 过期，会话还在；fresh_cookies 是响应 Set-Cookie 下发的新 token（可能为空）"""
+
+    def __init__(self, message, fresh_cookies: Optional[dict] = None):
+        super().__init__(message)
+        self.fresh_cookies = fresh_cookies or {}
+
+
+class MalformedPayloadError(CrawlError):
+    """返回内容不是预期的 JSON 结构"""
+
+
+class RetryPolicy:
+    def __init__(self, max_attempts: int, backoff: float, max_backoff: float = 30):
+        """
+        Args:
+            max_attempts: 该类错误最多尝试的次数（含第一次）
+            backoff: 第一次重试前的等待秒数，之后翻倍
+            max_backoff: 单次等待上限
+        """
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+
+    def delay(self, attempt: int) -> float:
+        return min(self.backoff * 2 ** (attempt - 1), self.max_backoff)
+
+
+# 子类要排在父类前面，按顺序匹配
+RETRY_POLICIES = {
+    TokenExpiredError: RetryPolicy(max_attempts=3, backoff=0.5),
+    TransportError: RetryPolicy(max_attempts=4, backoff=2),
+    ThrottledError: RetryPolicy(max_attempts=5, backoff=5, max_backoff=60),
+    AuthExpiredError: RetryPolicy(max_attempts=2, backoff=1),
+    MalformedPayloadError: RetryPolicy(max_attempts=2, backoff=2),
+}
+
+# mtop ret 码
+MTOP_TOKEN_CODES = ("FAIL_SYS_TOKEN",)
+MTOP_AUTH_CODES = ("FAIL_SYS_SESSION_EXPIRED", "SESSION_EXPIRED", "FAIL_SYS_ILLEGAL_ACCESS")
+# Set-Cookie 里和 token 有关的 cookie
+MTOP_TOKEN_COOKIES = ("_m_h5_tk", "_m_h5_tk_enc")
+MTOP_THROTTLE_CODES = ("FAIL_SYS_USER_VALIDATE", "FAIL_SYS_FLOWLIMIT", "FAIL_SYS_TRAFFIC_LIMIT", "RGV587")
+
+
+def check_http_status(status: int):
+    # 请求都不跟随重定向：会话失效时接口会 302 到登录页
+    if 300 <= status < 400:
+        raise AuthExpiredError(f"HTTP {status} 重定向（登录页）")
+    if status in (401, 403):
+        raise AuthExpiredError(f"HTTP {status}")
+    if status == 429:
+        raise ThrottledError(f"HTTP {status}")
+    if status != 200:
+        raise TransportError(f"HTTP 状态异常: {status}")
+
+
+def check_login_page(text: str):
+    """
+    返回的是 HTML 登录页（没走重定向，直接 200 返回了页面）时按登录失效处理
+    """
+    head = text.lstrip()[:2000].lower()
+    if head.startswith("<") and "login" in head:
+        raise AuthExpiredError("返回了登录页")
+
+
+def check_mtop_result(result, set_cookies: Optional[dict] = None):
+    """
+    mtop 接口：按 ret[0] 分类，成功时原样返回
+
+    set_cookies: 响应 Set-Cookie 下发的 cookie（name -> value），token 过期时带在异常上用于续期
+    """
+    if not isinstance(result, dict):
+        raise MalformedPayloadError(f"返回不是 JSON 对象: {str(result)[:200]}")
+
+    ret = result.get("ret") or [""]
+    code = str(ret[0]) if isinstance(ret, list) else str(ret)
+
+    if any(c in code for c in MTOP_TOKEN_CODES):
+        fresh = {k: v for k, v in (set_cookies or {}).items() if k in MTOP_TOKEN_COOKIES and v}
+        raise TokenExpiredError(code, fresh_cookies=fresh)
+    if any(c in code for c in MTOP_AUTH_CODES):
+        raise AuthExpiredError(code)
+    if any(c in code for c in MTOP_THROTTLE_CODES):
+        raise ThrottledError(code)
+    if "SUCCESS" not in code or "data" not in result:
+        raise MalformedPayloadError(f"mtop 返回异常: {code}")
+
+    return result
+
+
+def check_scm_result(result):
+    """
+    scm-supplier 接口：成功时原样返回
+    """
+    if not isinstance(result, dict):
+        raise MalformedPayloadError(f"返回不是 JSON 对象: {str(result)[:200]}")
+
+    code = str(result.get("errorCode") or result.get("code") or "").upper()
+    if "401" in result or code == "401" or "LOGIN" in code:
+        raise AuthExpiredError(code or "401")
+    if "LIMIT" in code:
+        raise ThrottledError(code)
+    if "data" not in result:
+        raise MalformedPayloadError(f"scm 返回异常: {code or str(result)[:200]}")
+
+    return result
+
+
+async def call_with_retry(
+        fetch: Callable[[], Awaitable],
+        on_auth_expired: Callable[[AuthExpiredError], Awaitable],
+        logger,
+        label: str,
+        policies: Optional[dict] = None,
+):
+    """
+    执行 fetch，按错误类别分别计数、退避重试；只有登录失效时调用 on_auth_expired(异常)
+
+    某类错误超过该类的 max_attempts 后抛出最后一次的异常
+    """
+    policies = policies or RETRY_POLICIES
+    attempts = {}
+
+    while True:
+        try:
+            return await fetch()
+        except CrawlError as e:
+            kind = next(k for k in policies if isinstance(e, k))
+            policy = policies[kind]
+            attempts[kind] = attempts.get(kind, 0) + 1
+
+            if attempts[kind] >= policy.max_attempts:
+                raise
+
+            logger.warning(
+                f"{label} {kind.__name__}: {e}（{attempts[kind]}/{policy.max_attempts}）"
+            )
+            if isinstance(e, AuthExpiredError):
+                await on_auth_expired(e)
+            await asyncio.sleep(policy.delay(attempts[kind]))
@@ -6,6 +6,7 @@ import requests
 from typing import Dict, Any, List, Optional
 import time
 from pathlib import Path
+from utils.rate_limiter import get_rate_limiter
 
 """上传/删除/查询钉钉多维表的数据"""
 
@@ -167,6 +168,9 @@ class DingTalkSheetUploader:
             "operatorId": operator_id
         }
 
+        # 与爬虫共用的按 host 限速器（多个店铺并发上传时共享 api.dingtalk.com 的配额）
+        self.rate_limiter = get_rate_limiter()
+
     def _get_headers(self) -> Dict[str, str]:
         """获取请求头，包含当前token"""
         return {
@@ -191,7 +195,7 @@ class DingTalkSheetUploader:
         Args:
             records_data: 多条记录数据列表
             batch_size: 每次批量上传的记录数（钉钉API可能有单次请求数量限制）
-            delay: 批次间的延迟时间（秒），避免请求频率过高
+            delay: 已不再使用，批次间的节奏由 rate_limiter 控制，保留参数兼容旧调用
             max_retries: 失败时的最大重试次数
 
         Returns:
@@ -216,10 +220,6 @@ class DingTalkSheetUploader:
             batch_result = self._upload_batch_with_retry(batch, max_retries)
             results.append(batch_result)
 
-            # 添加延迟，避免请求过于频繁
-            if i + batch_size < len(records_data):
-                time.sleep(delay)
-
             # 打印进度
             print(f"已上传 {min(i + batch_size, len(records_data))}/{len(records_data)} 条记录")
 
@@ -280,6 +280,9 @@ class DingTalkSheetUploader:
             ]
         }
 
+        # 按 api.dingtalk.com 的配额限速
+        self.rate_limiter.acquire_sync(self.url)
+
         try:
             response = requests.post(
                 url=self.url,
@@ -0,0 +1,154 @@
+import hashlib
+import json
+import threading
+import zipfile
+from datetime import datetime
+from pathlib import Path
+from typing import Optional
+
+"""财务导出文件的下载清单：每个文件的大小、sha256、店铺、月份、类型、下载时间
+
+重跑时清单里校验通过的文件直接跳过，只补缺失或损坏（截断的 zip 等）的
+"""
+
+BASE_DIR = Path(__file__).resolve().parent.parent
+MANIFEST_FILE = BASE_DIR / "data" / "financial" / "manifest.json"
+
+
+def sha256_file(path: Path) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def month_end(month_str: str) -> datetime:
+    """
+    '2025-12' -> 2026-01-01 00:00:00（该月结束的时刻）
+    """
+    year, month = map(int, month_str.split("-"))
+    return datetime(year + 1, 1, 1) if month == 12 else datetime(year, month + 1, 1)
+
+
+def verify_zip(path: Path) -> bool:
+    """
+    文件存在且是完整的 zip（xlsx 也是 zip 格式）
+    """
+    if not path.exists() or path.stat().st_size == 0:
+        return False
+    try:
+        with zipfile.ZipFile(path) as zf:
+            return zf.testzip() is None
+    except (zipfile.BadZipFile, OSError):
+        return False
+
+
+class DownloadManifest:
+    # 同进程内多个店铺并发写同一个清单
+    _lock = threading.Lock()
+
+    def __init__(self, manifest_file: Path = MANIFEST_FILE):
+        self.manifest_file = manifest_file
+
+    def _key(self, path: Path) -> str:
+        path = Path(path).resolve()
+        try:
+            return path.relative_to(BASE_DIR).as_posix()
+        except ValueError:
+            return path.as_posix()
+
+    def load(self) -> dict:
+        if not self.manifest_file.exists():
+            return {}
+        return json.loads(self.manifest_file.read_text(encoding="utf-8"))
+
+    def _save(self, entries: dict):
+        self.manifest_file.parent.mkdir(parents=True, exist_ok=True)
+        tmp_file = self.manifest_file.with_suffix(".json.tmp")
+        tmp_file.write_text(json.dumps(entries, ensure_ascii=False, indent=2), encoding="utf-8")
+        tmp_file.replace(self.manifest_file)
+
+    def get(self, path: Path) -> Optional[dict]:
+        return self.load().get(self._key(path))
+
+    def record(self, path: Path, shop: str, month: str, kind: str, downloaded_at: Optional[str] = None) -> dict:
+        """
+        下载完成后登记；每次写入前重新读一次，别的店铺刚写的条目不会被覆盖
+        """
+        path = Path(path)
+        entry = {
+            "shop": shop,
+            "month": month,
+            "kind": kind,
+            "size": path.stat().st_size,
+            "sha256": sha256_file(path),
+            "downloaded_at": downloaded_at or datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        }
+        with self._lock:
+            entries = self.load()
+            entries[self._key(path)] = entry
+            self._save(entries)
+        return entry
+
+    def forget(self, path: Path):
+        with self._lock:
+            entries = self.load()
+            if entries.pop(self._key(path), None) is not None:
+                self._save(entries)
+
+    def is_verified(self, path: Path, shop: str, month: str, kind: str) -> bool:
+        """
+        清单里有记录：大小和 sha256 都对得上才算
+        清单里没有（老文件）：该月结束后才下载的、zip 完整的补登记，否则算缺失
+        """
+        path = Path(path)
+        if not path.exists():
+            return False
+
+        entry = self.get(path)
+        if entry:
+            # 登记的不是同一个店铺 / 月份 / 类型，不能当作这次要的文件
+            if (entry["shop"], entry["month"], entry["kind"]) != (shop, month, kind):
+                return False
+            if entry["size"] == path.stat().st_size and entry["sha256"] == sha256_file(path):
+                return True
+            self.forget(path)
+            return False
+
+        # 没登记过的文件：只有在该月结束之后下载、且 zip 完整的才认，
+        # 否则可能是别的年份同月的旧文件，重新下载
+        mtime = datetime.fromtimestamp(path.stat().st_mtime)
+        if mtime >= month_end(month) and verify_zip(path):
+            self.record(path, shop, month, kind, downloaded_at=mtime.strftime("%Y-%m-%d %H:%M:%S"))
+            return True
+        return False
+
+    def adopt_legacy(self, legacy_path: Path, path: Path, shop: str, month: str, kind: str) -> bool:
+        """
+        老目录（不带年份）里的文件：按 is_verified 同样的规则校验，通过的移到新路径并改登记
+
+        新路径已有文件、老文件不存在或校验不过时什么都不做，返回 False
+        """
+        legacy_path, path = Path(legacy_path), Path(path)
+        if path.exists() or not legacy_path.exists():
+            return False
+        if not self.is_verified(legacy_path, shop, month, kind):
+            return False
+
+        downloaded_at = self.get(legacy_path)["downloaded_at"]
+        path.parent.mkdir(parents=True, exist_ok=True)
+        legacy_path.replace(path)
+        self.forget(legacy_path)
+        self.record(path, shop, month, kind, downloaded_at=downloaded_at)
+        return True
+
+
+_download_manifest: Optional[DownloadManifest] = None
+
+
+def get_download_manifest() -> DownloadManifest:
+    global _download_manifest
+    if _download_manifest is None:
+        _download_manifest = DownloadManifest()
+    return _download_manifest
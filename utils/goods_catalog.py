@@ -0,0 +1,126 @@
+import json
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Set
+
+from modules.smt_goods import SMTGoodsSpider
+from utils.logger import get_logger
+
+"""按店铺持久化的 货号ID → sku 映射，只在需要时增量抓取商品"""
+
+CATALOG_DIR = Path(__file__).resolve().parent.parent / "data" / "catalog"
+
+# 超过这么多天没全量同步，就全量重抓一次
+FULL_REFRESH_DAYS = 7
+
+TIME_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+
+class GoodsCatalog:
+    def __init__(self, shop_name: str, full_refresh_days: int = FULL_REFRESH_DAYS):
+        self.shop_name = shop_name
+        self.catalog_file = CATALOG_DIR / f"{shop_name}.json"
+        self.full_refresh_days = full_refresh_days
+        self.logger = get_logger("goods_catalog")
+
+        self.skus: Dict[str, str] = {}
+        self.last_synced: Optional[str] = None
+        self.last_full_synced: Optional[str] = None
+        # 上次全量之后增量找过但商品列表里没有的货号ID，避免每天重复全量翻页
+        self.not_found: Set[str] = set()
+
+        self.load()
+
+    # ---------- 读写 ----------
+    def load(self):
+        if not self.catalog_file.exists():
+            return
+
+        data = json.loads(self.catalog_file.read_text(encoding="utf-8"))
+        self.skus = data.get("skus", {})
+        self.last_synced = data.get("last_synced")
+        self.last_full_synced = data.get("last_full_synced")
+        self.not_found = set(data.get("not_found", []))
+
+    def save(self):
+        CATALOG_DIR.mkdir(parents=True, exist_ok=True)
+
+        data = {
+            "shop_name": self.shop_name,
+            "last_synced": self.last_synced,
+            "last_full_synced": self.last_full_synced,
+            "not_found": sorted(self.not_found),
+            "skus": self.skus,
+        }
+
+        # 先写临时文件再替换，避免中途崩溃留下半个文件
+        tmp_file = self.catalog_file.with_suffix(".json.tmp")
+        tmp_file.write_text(json.dumps(data, ensure_ascii=False, indent=2), encoding="utf-8")
+        tmp_file.replace(self.catalog_file)
+
+    # ---------- 查询 ----------
+    def lookup(self, scitem_id) -> str:
+        return self.skus.get(str(scitem_id), "")
+
+    def missing(self, scitem_ids: Iterable) -> Set[str]:
+        """
+        目录里没有、且上次全量之后也没找过的货号ID
+        """
+        ids = {str(i) for i in scitem_ids}
+        return ids - self.skus.keys() - self.not_found
+
+    def needs_full_refresh(self) -> bool:
+        if not self.last_full_synced or not self.skus:
+            return True
+        last = datetime.strptime(self.last_full_synced, TIME_FORMAT)
+        return datetime.now() - last >= timedelta(days=self.full_refresh_days)
+
+    # ---------- 更新 ----------
+    def update(self, items: List[dict], full: bool = False):
+        fresh = {str(i["货号ID"]): i.get("sku") or "" for i in items}
+
+        now = datetime.now().strftime(TIME_FORMAT)
+        if full:
+            # 全量：以这次抓到的为准（下架商品一并清掉）
+            self.skus = fresh
+            self.not_found = set()
+            self.last_full_synced = now
+        else:
+            self.skus.update(fresh)
+        self.last_synced = now
+
+    # ---------- 同步 ----------
+    async def sync(self, wanted_ids: Optional[Iterable] = None, force_full: bool = False):
+        """
+        force_full / 到期：全量抓取
+        否则只在 wanted_ids 里有未知货号ID时才增量抓取，找齐即停
+        """
+        spider = SMTGoodsSpider(self.shop_name)
+
+        if force_full or self.needs_full_refresh():
+            self.logger.info(f"[{self.shop_name}] 商品目录全量同步")
+            items = await spider.run(save=False)
+
+            # 中途失败的不能当全量用，只合并
+            self.update(items, full=spider.completed)
+            self.save()
+            return
+
+        missing = self.missing(wanted_ids or [])
+        if not missing:
+            self.logger.info(f"[{self.shop_name}] 商品目录已覆盖全部货号ID，跳过抓取")
+            return
+
+        self.logger.info(f"[{self.shop_name}] 有 {len(missing)} 个未知货号ID，增量同步商品目录")
+        items = await spider.run(wanted_ids=missing, save=False)
+        self.update(items)
+
+        if spider.completed:
+            still_missing = missing - self.skus.keys()
+            if still_missing:
+                self.logger.warning(
+                    f"[{self.shop_name}] {len(still_missing)} 个货号ID在商品列表中不存在，下次全量前不再查找"
+                )
+            self.not_found |= still_missing
+
+        self.save()
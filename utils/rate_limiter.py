@@ -0,0 +1,112 @@
+import asyncio
+import threading
+import time
+from typing import Dict, Optional
+from urllib.parse import urlparse
+
+from utils.config_loader import load_config
+
+"""按 host 限速的令牌桶（所有爬虫、所有店铺共享一个实例）"""
+
+# rate: 每秒补充的令牌数；burst: 桶容量（允许的瞬时突发）
+# "global" 为所有 host 合计的上限
+# 可以在 config.json 里用 "rate_limits" 覆盖
+DEFAULT_RATE_LIMITS = {
+    "seller-acs.aliexpress.com": {"rate": 2, "burst": 3},
+    "scm-supplier.aliexpress.com": {"rate": 2, "burst": 3},
+    "api.dingtalk.com": {"rate": 10, "burst": 10},
+    "global": {"rate": 8, "burst": 10},
+}
+
+
+class TokenBucket:
+    def __init__(self, rate: float, burst: float):
+        self.rate = float(rate)
+        self.burst = float(burst)
+        self.tokens = self.burst
+        self.updated_at = time.monotonic()
+        # 线程锁：钉钉上传跑在线程里，也要共用同一个桶
+        self._lock = threading.Lock()
+
+    def reserve(self, tokens: float = 1.0) -> float:
+        """
+        预约令牌，返回需要等待的秒数
+
+        令牌允许透支：预约成功后这段等待时间就归调用方，
+        后来的调用会排在它后面，不会被抢走
+        """
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.updated_at) * self.rate)
+            self.updated_at = now
+
+            self.tokens -= tokens
+            if self.tokens >= 0:
+                return 0.0
+            return -self.tokens / self.rate
+
+
+class RateLimiter:
+    def __init__(self, limits: Optional[Dict[str, dict]] = None):
+        self.limits = {**DEFAULT_RATE_LIMITS, **(limits or {})}
+        self._buckets: Dict[str, Optional[TokenBucket]] = {}
+        self._lock = threading.Lock()
+
+        global_cfg = self.limits.get("global")
+        self._global = TokenBucket(global_cfg["rate"], global_cfg["burst"]) if global_cfg else None
+
+    def _get_bucket(self, host: str) -> Optional[TokenBucket]:
+        with self._lock:
+            if host not in self._buckets:
+                cfg = self.limits.get(host)
+                self._buckets[host] = TokenBucket(cfg["rate"], cfg["burst"]) if cfg else None
+            return self._buckets[host]
+
+    def reserve_host(self, url_or_host: str) -> float:
+        """
+        向 host 桶预约，返回需要等待的秒数
+        """
+        host = urlparse(url_or_host).netloc if "://" in url_or_host else url_or_host
+        bucket = self._get_bucket(host)
+        return bucket.reserve() if bucket else 0.0
+
+    def reserve_global(self) -> float:
+        return self._global.reserve() if self._global else 0.0
+
+    async def acquire(self, url_or_host: str):
+        """
+        先等到 host 的时间片，再向全局桶预约：
+        排在 host 队列里的请求不占全局令牌，全局上限只算真正要发出去的请求
+        """
+        wait = self.reserve_host(url_or_host)
+        if wait > 0:
+            await asyncio.sleep(wait)
+        wait = self.reserve_global()
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+    def acquire_sync(self, url_or_host: str):
+        """
+        同步代码（requests）使用
+        """
+        wait = self.reserve_host(url_or_host)
+        if wait > 0:
+            time.sleep(wait)
+        wait = self.reserve_global()
+        if wait > 0:
+            time.sleep(wait)
+
+
+_rate_limiter: Optional[RateLimiter] = None
+_rate_limiter_lock = threading.Lock()
+
+
+def get_rate_limiter() -> RateLimiter:
+    """
+    进程内唯一的限速器
+    """
+    global _rate_limiter
+    with _rate_limiter_lock:
+        if _rate_limiter is None:
+            _rate_limiter = RateLimiter(load_config().get("rate_limits"))
+        return _rate_limiter
@@ -0,0 +1,119 @@
+import re
+from typing import Iterable, Optional
+
+from utils.config_loader import load_config
+from utils.logger import get_logger
+
+"""Playwright 请求拦截：登录、财务导出只需要 DOM 和下载，图片 / 字体 / 视频 / 埋点统统不加载
+
+默认关闭，在 config.json 里打开：
+    "request_blocking": {
+        "enabled": true,
+        "block_resource_types": [...],   # 可选，覆盖默认
+        "block_url_patterns": [...],     # 可选，追加
+        "allow_url_patterns": [...]      # 可选，追加（优先级最高）
+    }
+"""
+
+DEFAULT_BLOCK_RESOURCE_TYPES = ("image", "font", "media")
+
+# 统计 / 埋点 / 广告
+DEFAULT_BLOCK_URL_PATTERNS = (
+    r"google-analytics\.com",
+    r"googletagmanager\.com",
+    r"doubleclick\.net",
+    r"bat\.bing\.com",
+    r"connect\.facebook\.net",
+    r"\.mmstat\.com",
+    r"arms-retcode",
+    r"/aplus[^/]*\.js",
+)
+
+# 滑块 / 风控相关的资源不能拦，否则登录页会卡住
+DEFAULT_ALLOW_URL_PATTERNS = (
+    r"captcha",
+    r"baxia",
+    r"AWSC",
+    r"/nc/",
+    r"punish",
+)
+
+
+class RequestBlocker:
+    def __init__(
+            self,
+            block_resource_types: Iterable[str] = DEFAULT_BLOCK_RESOURCE_TYPES,
+            block_url_patterns: Iterable[str] = DEFAULT_BLOCK_URL_PATTERNS,
+            allow_url_patterns: Iterable[str] = DEFAULT_ALLOW_URL_PATTERNS,
+            name: str = "",
+    ):
+        self.block_resource_types = set(block_resource_types)
+        self.block_url_re = self._compile(block_url_patterns)
+        self.allow_url_re = self._compile(allow_url_patterns)
+        self.name = name
+        self.logger = get_logger("request_blocker")
+
+        self.blocked = 0
+        self.allowed = 0
+        self._context = None
+
+    @staticmethod
+    def _compile(patterns: Iterable[str]):
+        patterns = list(patterns)
+        return re.compile("|".join(f"(?:{p})" for p in patterns)) if patterns else None
+
+    @classmethod
+    def from_config(cls, name: str = "") -> Optional["RequestBlocker"]:
+        """
+        config.json 里没有打开时返回 None
+        """
+        cfg = load_config().get("request_blocking") or {}
+        if not cfg.get("enabled"):
+            return None
+
+        return cls(
+            block_resource_types=cfg.get("block_resource_types", DEFAULT_BLOCK_RESOURCE_TYPES),
+            block_url_patterns=[*DEFAULT_BLOCK_URL_PATTERNS, *cfg.get("block_url_patterns", [])],
+            allow_url_patterns=[*DEFAULT_ALLOW_URL_PATTERNS, *cfg.get("allow_url_patterns", [])],
+            name=name,
+        )
+
+    def should_block(self, resource_type: str, url: str) -> bool:
+        if self.allow_url_re and self.allow_url_re.search(url):
+            return False
+        if resource_type in self.block_resource_types:
+            return True
+        return bool(self.block_url_re and self.block_url_re.search(url))
+
+    async def _handle(self, route):
+        request = route.request
+        if self.should_block(request.resource_type, request.url):
+            self.blocked += 1
+            await route.abort()
+        else:
+            self.allowed += 1
+            await route.fallback()
+
+    async def attach(self, context):
+        """
+        在 context 上挂拦截；context 是复用的，用完一定要 detach
+        """
+        self._context = context
+        await context.route("**/*", self._handle)
+
+    async def detach(self):
+        if self._context is None:
+            return
+        try:
+            await self._context.unroute("**/*", self._handle)
+        except Exception as e:
+            self.logger.warning(f"[{self.name}] 取消请求拦截失败: {e}")
+        finally:
+            self._context = None
+            self.log_stats()
+
+    def log_stats(self):
+        total = self.blocked + self.allowed
+        self.logger.info(
+            f"[{self.name}] 请求拦截：共 {total} 个，拦截 {self.blocked} 个，放行 {self.allowed} 个"
+        )
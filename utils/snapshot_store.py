@@ -0,0 +1,105 @@
+from datetime import datetime
+from pathlib import Path
+from typing import List, Optional
+
+try:
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+    import pyarrow.parquet as pq
+except ImportError:  # 只写 csv 时不需要 pyarrow
+    pa = ds = pq = None
+
+"""销售数据的列式快照：data/snapshots/{kind}/shop={店铺}/date={YYYYMMDD}/part-{页码}.parquet"""
+
+SNAPSHOT_DIR = Path(__file__).resolve().parent.parent / "data" / "snapshots"
+
+# 明确的列类型，读的时候不再靠 csv 类型推断
+SCHEMA_FIELDS = {
+    "goods": [
+        ("货号ID", "string"),
+        ("sku", "string"),
+    ],
+    "stock": [
+        ("平台", "string"),
+        ("店铺", "string"),
+        ("货号ID", "string"),
+        ("商品名称", "string"),
+        ("抓取数据日期", "int64"),
+        ("今日销量", "int64"),
+        ("近7天销量", "int64"),
+        ("近30天销量", "int64"),
+        ("平台库存", "int64"),
+        ("在途库存", "int64"),
+    ],
+}
+
+
+def _require_pyarrow():
+    if pa is None:
+        raise RuntimeError("写/读 parquet 快照需要安装 pyarrow")
+
+
+def get_schema(kind: str):
+    _require_pyarrow()
+    return pa.schema([(name, getattr(pa, type_name)()) for name, type_name in SCHEMA_FIELDS[kind]])
+
+
+def snapshot_dir(kind: str, shop_name: str, date_str: Optional[str] = None) -> Path:
+    date_str = date_str or datetime.now().strftime("%Y%m%d")
+    return SNAPSHOT_DIR / kind / f"shop={shop_name}" / f"date={date_str}"
+
+
+def _normalize(value, type_name: str):
+    if value is None or value == "":
+        return None
+    if type_name == "int64":
+        return int(value)
+    return str(value)
+
+
+def write_snapshot(kind: str, shop_name: str, page: int, items: List[dict], date_str: Optional[str] = None) -> Path:
+    """
+    一页一个 part 文件；同一页重跑会覆盖，天然幂等
+    """
+    _require_pyarrow()
+
+    fields = SCHEMA_FIELDS[kind]
+    columns = {
+        name: [_normalize(item.get(name), type_name) for item in items]
+        for name, type_name in fields
+    }
+    table = pa.table(columns, schema=get_schema(kind))
+
+    out_dir = snapshot_dir(kind, shop_name, date_str)
+    out_dir.mkdir(parents=True, exist_ok=True)
+
+    path = out_dir / f"part-{page:05d}.parquet"
+    # 以 "." 开头，读取时会被 pyarrow 忽略
+    tmp_path = out_dir / f".{path.name}.tmp"
+    pq.write_table(table, tmp_path, compression="zstd")
+    tmp_path.replace(path)
+    return path
+
+
+def has_snapshot(kind: str, shop_name: str, date_str: Optional[str] = None) -> bool:
+    path = snapshot_dir(kind, shop_name, date_str)
+    return path.exists() and any(path.glob("part-*.parquet"))
+
+
+def read_snapshot(kind: str, shop_name: str, columns: Optional[List[str]] = None, date_str: Optional[str] = None):
+    """
+    读取某店铺某天的快照（只读需要的列），返回 pandas.DataFrame
+    """
+    _require_pyarrow()
+    dataset = ds.dataset(snapshot_dir(kind, shop_name, date_str), format="parquet", schema=get_schema(kind))
+    return dataset.to_table(columns=columns).to_pandas()
+
+
+def read_history(kind: str, columns: Optional[List[str]] = None, filter=None):
+    """
+    按 shop / date 分区查询历史快照，例如：
+        read_history("stock", ["货号ID", "今日销量"], ds.field("shop") == "SMT202")
+    """
+    _require_pyarrow()
+    dataset = ds.dataset(SNAPSHOT_DIR / kind, format="parquet", partitioning="hive")
+    return dataset.to_table(columns=columns, filter=filter).to_pandas()